@@ -0,0 +1,36 @@
+import ijson
+
+# Streams analytics rules out of Sentinel workspace exports (ARM templates) without loading the whole file.
+# ijson parses the file incrementally, so only one resource is held in memory at a time.
+
+# What a truncated, invalid or unreadable bundle raises part way through iter_arm_alert_rules
+BUNDLE_ERRORS = (ijson.JSONError, ValueError, OSError)
+
+def _items_prefix(bundle_path):
+    """ARM templates keep the rules under "resources"; a bare JSON array of rules is read item by item."""
+    with open(bundle_path, "rb") as f:
+        for prefix, event, value in ijson.parse(f):
+            return "item" if event == "start_array" else "resources.item"
+    return "resources.item"
+
+def is_alert_rule(resource):
+    # Exports use Microsoft.SecurityInsights/alertRules or the older
+    # Microsoft.OperationalInsights/workspaces/providers/alertRules resource type
+    return str(resource.get("type", "")).lower().endswith("/alertrules")
+
+def iter_arm_alert_rules(bundle_path):
+    """
+    Yield (name, rule) for every alert rule resource with a query in an exported bundle.
+    rule is the resource's properties (query, queryFrequency, entityMappings, ...) with "name" set to the
+    rule's displayName, so it can go through the same processing as a rule loaded from YAML. Resources
+    whose properties aren't an object are skipped; a bundle that can't be parsed raises one of BUNDLE_ERRORS.
+    """
+    with open(bundle_path, "rb") as f:
+        for resource in ijson.items(f, _items_prefix(bundle_path), use_float=True):
+            if not isinstance(resource, dict) or not is_alert_rule(resource):
+                continue
+            properties = resource.get("properties")
+            if not isinstance(properties, dict) or not str(properties.get("query", "")).strip():
+                continue
+            name = str(properties.get("displayName") or resource.get("name") or "")
+            yield name, dict(properties, name=name)
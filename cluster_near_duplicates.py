@@ -0,0 +1,139 @@
+import os
+import re
+import csv
+import zlib
+import numpy as np
+from dotenv import load_dotenv
+
+from generate_detection_profiles import iter_rules, parse_kql_for_fields, create_detection_profile
+from process_detection_profiles import get_joined_classification
+from kql_pipeline import strip_comments
+
+load_dotenv()
+
+SENTINEL_RULES = os.getenv("SENTINEL_RULES")
+NEAR_DUPLICATES_CSV = "near_duplicate_clusters.csv"
+
+# Shingles are runs of this many query tokens
+SHINGLE_SIZE = 4
+# Signature length is BANDS * ROWS; with 16 bands of 8 rows, pairs above ~0.7 Jaccard
+# almost always share a band and pairs below ~0.4 almost never do
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+# Candidates below this estimated Jaccard similarity are not clustered
+JACCARD_THRESHOLD = 0.8
+
+MERSENNE_PRIME = (1 << 31) - 1
+TOKEN_PATTERN = re.compile(r'[a-z_][a-z0-9_.\-]*|\d+|"[^"]*"|\'[^\']*\'|[^\s\w]')
+
+# Fixed seed so signatures, and therefore clusters, are the same on every run
+_random = np.random.RandomState(20240131)
+PERMUTATION_A = _random.randint(1, MERSENNE_PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+PERMUTATION_B = _random.randint(0, MERSENNE_PRIME, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+def query_shingles(query_text):
+    """The set of hashed token shingles of a query, comments removed and case folded."""
+    tokens = TOKEN_PATTERN.findall(strip_comments(query_text).lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(tokens).encode("utf-8"))}
+    return {zlib.crc32(" ".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8"))
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+def minhash_signature(shingles):
+    """MinHash signature: for each of the universal hash functions, the smallest hash over the shingles."""
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    permuted = (PERMUTATION_A[:, None] * hashes[None, :] + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+def estimated_jaccard(signature_a, signature_b):
+    return float(np.mean(signature_a == signature_b))
+
+def find_clusters(signatures):
+    """
+    Cluster rules whose signatures collide in at least one LSH band and whose estimated Jaccard
+    similarity passes JACCARD_THRESHOLD. Members of a band bucket are compared to the bucket's first
+    rule only, so identical copies cost one comparison each rather than one per pair.
+    Returns a list of clusters (lists of row indexes), each with two or more rules.
+    """
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(BANDS):
+        buckets = {}
+        band_rows = signatures[:, band * ROWS:(band + 1) * ROWS]
+        for index, row in enumerate(band_rows):
+            buckets.setdefault(row.tobytes(), []).append(index)
+
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                root_first, root_other = find(first), find(other)
+                if root_first == root_other:
+                    continue
+                if estimated_jaccard(signatures[first], signatures[other]) >= JACCARD_THRESHOLD:
+                    parent[max(root_first, root_other)] = min(root_first, root_other)
+
+    clusters = {}
+    for index in range(len(signatures)):
+        clusters.setdefault(find(index), []).append(index)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def create_near_duplicates_csv(clusters, detections, signatures, profiles, output_csv):
+    """
+    One row per rule in a near-duplicate cluster, largest clusters first. The similarity column is the
+    estimated Jaccard similarity to the cluster's first rule (1.0 for that rule itself).
+    """
+    clusters = sorted(clusters, key=lambda x: (-len(x), x[0]))
+
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["cluster", "cluster size", "detection", "estimated jaccard", "classification", "joined classification"])
+        for cluster_id, members in enumerate(clusters, start=1):
+            representative = signatures[members[0]]
+            for index in members:
+                profile = profiles[index]
+                writer.writerow([
+                    cluster_id,
+                    len(members),
+                    detections[index],
+                    round(estimated_jaccard(representative, signatures[index]), 3),
+                    profile["classification"]["Overall"],
+                    get_joined_classification(profile) or "",
+                ])
+
+def main():
+    if not os.path.exists(SENTINEL_RULES):
+        print(f"'{SENTINEL_RULES}' not found")
+        exit()
+
+    detections = []
+    profiles = []
+    signatures = []
+    for file, data in iter_rules(SENTINEL_RULES):
+        query_text = data.get("query", "")
+        good_fields_data, _ = parse_kql_for_fields(query_text, file)
+        detections.append(file)
+        profiles.append(create_detection_profile(file, good_fields_data))
+        signatures.append(minhash_signature(query_shingles(query_text)))
+
+    if not signatures:
+        print("No queries found.")
+        return
+
+    signatures = np.vstack(signatures)
+    clusters = find_clusters(signatures)
+
+    try:
+        create_near_duplicates_csv(clusters, detections, signatures, profiles, NEAR_DUPLICATES_CSV)
+        print(f"{len(clusters)} near-duplicate clusters ({sum(len(x) for x in clusters)} detections) written to {NEAR_DUPLICATES_CSV}")
+    except Exception as e:
+        print(f"Failed to write {NEAR_DUPLICATES_CSV}: {e}")
+
+if __name__ == "__main__":
+    main()
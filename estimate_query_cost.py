@@ -0,0 +1,236 @@
+import os
+import re
+import csv
+from datetime import timedelta
+from dotenv import load_dotenv
+
+from generate_detection_profiles import iter_rules
+from kql_pipeline import parse_query, stage_operator, strip_comments, strip_strings
+
+load_dotenv()
+
+SENTINEL_RULES = os.getenv("SENTINEL_RULES")
+COST_CSV = "query_costs.csv"
+
+# Points added to a query's static score for each occurrence of a costly construct.
+COST_WEIGHTS = {
+    "stage": 1,
+    "union_star": 25,
+    "search_star": 25,
+    "missing_time_filter": 10,
+    "regex": 5,
+    "mv_expand": 4,
+    "high_cardinality_key": 3,
+    "lookup": 3,
+}
+
+# Joins are weighted by kind; KQL's default kind is innerunique.
+JOIN_KIND_WEIGHTS = {
+    "innerunique": 6,
+    "inner": 6,
+    "leftouter": 8,
+    "rightouter": 8,
+    "fullouter": 10,
+    "leftsemi": 4,
+    "rightsemi": 4,
+    "leftanti": 4,
+    "rightanti": 4,
+    "anti": 4,
+}
+
+# summarize-by keys whose name ends in one of these usually have a distinct value per entity or event.
+# A column name is split into its camel-case / underscore words (IPAddress -> ip, address; TargetUserName ->
+# target, user, name) and a hint has to be its last word(s), optionally followed by "name": CorrelationId,
+# ProcessCommandLine and TargetUserName match, DeviceVendor, UserType and Idle don't.
+HIGH_CARDINALITY_HINTS = (
+    "id", "guid", "ip", "address", "addr", "url", "hash", "commandline", "path", "session",
+    "correlation", "upn", "principal", "account", "user", "host", "computer", "device",
+)
+# Columns that match a hint but only take a handful of values
+LOW_CARDINALITY_KEYS = {"eventid"}
+
+# Sources that don't read a table, so don't need a time filter
+NON_TABLE_SOURCES = {"union", "search", "datatable", "print", "range", "externaldata", "materialize", "find"}
+
+KEY_IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+KEY_WORD_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+JOIN_PATTERN = re.compile(r'\bjoin\b(?:\s+hint\.\w+\s*=\s*\w+)*(?:\s+kind\s*=\s*(\w+))?', re.IGNORECASE)
+LOOKUP_PATTERN = re.compile(r'\|\s*lookup\b', re.IGNORECASE)
+UNION_STAR_PATTERN = re.compile(r'\bunion\b[^|]*?\*', re.IGNORECASE)
+# A search that names its tables ("search in (T1, T2) ...") only scans those
+SEARCH_IN_PATTERN = re.compile(r'^search\s+(?:kind\s*=\s*\w+\s+)?in\s*\(', re.IGNORECASE)
+REGEX_PATTERN = re.compile(r'\bmatches\s+regex\b|\bextract(?:_all)?\s*\(|\breplace_regex\s*\(|\bparse\s+kind\s*=\s*regex\b', re.IGNORECASE)
+MV_EXPAND_PATTERN = re.compile(r'\bmv-(?:expand|apply)\b', re.IGNORECASE)
+TIME_FILTER_PATTERN = re.compile(r'timegenerated|\bago\s*\(|\bbetween\s*\(', re.IGNORECASE)
+SUMMARIZE_BY_PATTERN = re.compile(r'\sby\s', re.IGNORECASE)
+DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+DURATION_PATTERN = re.compile(r'^(\d+)\s*([smhd])$', re.IGNORECASE)
+ISO_DURATION_PATTERN = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$', re.IGNORECASE)
+
+def parse_duration(value):
+    """
+    Parse a rule duration such as '5m', '1h', '14d' (or the ISO-8601 form 'PT5M', 'P14D' used in ARM exports).
+    Returns a timedelta, or None if the value is missing or not understood.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+
+    match = DURATION_PATTERN.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2).lower()
+        return timedelta(**{DURATION_UNITS[unit]: amount})
+
+    match = ISO_DURATION_PATTERN.match(value)
+    if match and any(match.groups()):
+        days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+        return timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+    return None
+
+def schedule_factor(query_frequency, query_period):
+    """
+    Days of data scanned per day by a scheduled rule: runs per day times the lookback in days.
+    Rules without a usable schedule (e.g. NRT rules) get a factor of 1.
+    """
+    frequency = parse_duration(query_frequency)
+    period = parse_duration(query_period)
+    if not frequency or not period:
+        return 1.0
+    runs_per_day = timedelta(days=1) / frequency
+    lookback_days = period / timedelta(days=1)
+    return runs_per_day * lookback_days
+
+def summarize_keys(stage):
+    """The group-by keys of a summarize stage."""
+    parts = SUMMARIZE_BY_PATTERN.split(stage, maxsplit=1)
+    if len(parts) < 2:
+        return []
+    return [key.strip() for key in re.split(r',(?![^(]*\))', parts[1]) if key.strip()]
+
+def is_high_cardinality_key(key):
+    # An aliased key (Day = bin(...)) is judged by its expression
+    expression = key.split("=", 1)[-1].strip()
+    if expression.lower().startswith("bin("):
+        return False
+    for identifier in KEY_IDENTIFIER_PATTERN.findall(expression):
+        if identifier.lower() in LOW_CARDINALITY_KEYS:
+            continue
+        words = [word.lower() for word in KEY_WORD_PATTERN.findall(identifier)]
+        for i in range(len(words)):
+            tail = "".join(words[i:])
+            if any(tail == hint or tail == hint + "name" for hint in HIGH_CARDINALITY_HINTS):
+                return True
+    return False
+
+def estimate_query_cost(query_text):
+    """
+    Count the costly constructs in a KQL query and combine them into a static score.
+    Returns a dict of the individual counts plus "query score".
+    """
+    code = strip_strings(strip_comments(query_text))
+    statements = parse_query(query_text) or []
+    let_names = {statement["let"].lower() for statement in statements if statement["let"]}
+
+    join_kinds = [(kind or "innerunique").lower() for kind in JOIN_PATTERN.findall(code)]
+
+    stages = 0
+    search_star = 0
+    missing_time_filter = 0
+    high_cardinality_keys = 0
+    for statement in statements:
+        statement_stages = statement["stages"]
+        stages += len(statement_stages) - 1
+
+        for stage in statement_stages:
+            if stage_operator(stage) == "summarize":
+                high_cardinality_keys += sum(1 for key in summarize_keys(stage) if is_high_cardinality_key(key))
+
+        # Only a search that starts a statement scans every table; a piped search filters the rows above it
+        source = stage_operator(statement_stages[0])
+        if source == "search" and not SEARCH_IN_PATTERN.match(statement_stages[0]):
+            search_star += 1
+
+        # A table read should be followed straight away by a where on the time column
+        if not source or source in NON_TABLE_SOURCES or source in let_names or len(statement_stages) < 2:
+            continue
+        if statement["let"] and "(" in statement_stages[0]:
+            continue
+        early_filters = []
+        for stage in statement_stages[1:]:
+            if stage_operator(stage) != "where":
+                break
+            early_filters.append(stage)
+        if not any(TIME_FILTER_PATTERN.search(stage) for stage in early_filters):
+            missing_time_filter += 1
+
+    costs = {
+        "stages": stages,
+        "joins": len(join_kinds),
+        "join kinds": ";".join(sorted(set(join_kinds))),
+        "lookups": len(LOOKUP_PATTERN.findall(code)),
+        "union *": len(UNION_STAR_PATTERN.findall(code)),
+        "search *": search_star,
+        "missing time filter": missing_time_filter,
+        "regex": len(REGEX_PATTERN.findall(code)),
+        "mv-expand": len(MV_EXPAND_PATTERN.findall(code)),
+        "high-cardinality keys": high_cardinality_keys,
+    }
+
+    score = 1
+    score += costs["stages"] * COST_WEIGHTS["stage"]
+    score += sum(JOIN_KIND_WEIGHTS.get(kind, JOIN_KIND_WEIGHTS["innerunique"]) for kind in join_kinds)
+    score += costs["lookups"] * COST_WEIGHTS["lookup"]
+    score += costs["union *"] * COST_WEIGHTS["union_star"]
+    score += costs["search *"] * COST_WEIGHTS["search_star"]
+    score += costs["missing time filter"] * COST_WEIGHTS["missing_time_filter"]
+    score += costs["regex"] * COST_WEIGHTS["regex"]
+    score += costs["mv-expand"] * COST_WEIGHTS["mv_expand"]
+    score += costs["high-cardinality keys"] * COST_WEIGHTS["high_cardinality_key"]
+    costs["query score"] = score
+
+    return costs
+
+def rule_cost(detection_filename, data):
+    """Static query score of a rule scaled by how much data its schedule makes it scan."""
+    costs = estimate_query_cost(data.get("query", ""))
+    factor = schedule_factor(data.get("queryFrequency"), data.get("queryPeriod"))
+    return {
+        "detection": detection_filename,
+        "cost": round(costs["query score"] * factor, 2),
+        "query score": costs["query score"],
+        "queryFrequency": data.get("queryFrequency", ""),
+        "queryPeriod": data.get("queryPeriod", ""),
+        **{key: value for key, value in costs.items() if key != "query score"},
+    }
+
+def create_cost_csv(rule_costs, output_csv):
+    """
+    Write the rules ranked by estimated cost, most expensive first, with the counts behind each score.
+    """
+    ranked = sorted(rule_costs, key=lambda x: x["cost"], reverse=True)
+    columns = ["rank", "detection", "cost", "query score", "queryFrequency", "queryPeriod", "stages", "joins",
+               "join kinds", "lookups", "union *", "search *", "missing time filter", "regex", "mv-expand",
+               "high-cardinality keys"]
+
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rank, row in enumerate(ranked, start=1):
+            writer.writerow([rank] + [row[column] for column in columns[1:]])
+
+def main():
+    if not os.path.exists(SENTINEL_RULES):
+        print(f"'{SENTINEL_RULES}' not found")
+        exit()
+
+    rule_costs = [rule_cost(file, data) for file, data in iter_rules(SENTINEL_RULES)]
+
+    try:
+        create_cost_csv(rule_costs, COST_CSV)
+        print(f"Query costs for {len(rule_costs)} detections written to {COST_CSV}")
+    except Exception as e:
+        print(f"Failed to write {COST_CSV}: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import argparse
+import numpy as np
+from scipy import sparse
+
+# Reads the parsed field records in good_fields.json and writes compact sparse matrices for notebooks:
+#   detection_field_incidence.npz  detection x field, 1 where the detection uses the field
+#   field_cooccurrence.npz         field x field, number of detections using both (top-k per field)
+#   detection_similarity.npz       detection x detection, cosine or Jaccard similarity (top-k per detection)
+#   cooccurrence_index.json        row/column labels for the matrices above
+# Load them with scipy.sparse.load_npz.
+
+GOOD_FIELDS_JSON = "good_fields.json"
+INCIDENCE_NPZ = "detection_field_incidence.npz"
+COOCCURRENCE_NPZ = "field_cooccurrence.npz"
+SIMILARITY_NPZ = "detection_similarity.npz"
+INDEX_JSON = "cooccurrence_index.json"
+
+# Rows of the left-hand matrix multiplied at a time; bounds the size of each intermediate product
+CHUNK_ROWS = 2000
+
+def build_incidence_matrix(field_records):
+    """
+    Build the binary detection x field incidence matrix in CSR form from parsed field records.
+    Detections and fields are numbered in order of first appearance.
+    """
+    detection_ids = {}
+    field_ids = {}
+    rows, columns = [], []
+    for record in field_records:
+        row = detection_ids.setdefault(record["detection"], len(detection_ids))
+        column = field_ids.setdefault(record["field"].lower(), len(field_ids))
+        rows.append(row)
+        columns.append(column)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(detection_ids), len(field_ids)),
+    )
+    # A field used on several lines of the same detection still counts once
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+    return incidence, list(detection_ids), list(field_ids)
+
+def top_k_rows(block, k, row_offset, drop_self=True):
+    """Keep the k largest entries of each row of a CSR block (and drop the diagonal entry if drop_self)."""
+    block = block.tocsr()
+    rows, columns, values = [], [], []
+    for local_row in range(block.shape[0]):
+        start, end = block.indptr[local_row], block.indptr[local_row + 1]
+        row_columns = block.indices[start:end]
+        row_values = block.data[start:end]
+        if drop_self:
+            keep = row_columns != row_offset + local_row
+            row_columns, row_values = row_columns[keep], row_values[keep]
+        if len(row_values) > k:
+            best = np.argpartition(-row_values, k - 1)[:k]
+            row_columns, row_values = row_columns[best], row_values[best]
+        rows.append(np.full(len(row_columns), row_offset + local_row))
+        columns.append(row_columns)
+        values.append(row_values)
+
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    return np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+
+def pruned_product(left, right, k, transform=None, min_value=0.0):
+    """
+    left @ right, computed CHUNK_ROWS rows at a time and pruned to the top k entries per row, so memory
+    stays around one chunk's product plus k entries per row. transform(block, first_row) may rescale each
+    chunk's raw product before pruning.
+    """
+    rows, columns, values = [], [], []
+    for first_row in range(0, left.shape[0], CHUNK_ROWS):
+        block = (left[first_row:first_row + CHUNK_ROWS] @ right).tocsr()
+        if transform is not None:
+            block = transform(block, first_row)
+        if min_value:
+            block.data[block.data < min_value] = 0
+            block.eliminate_zeros()
+        block_rows, block_columns, block_values = top_k_rows(block, k, first_row)
+        rows.append(block_rows)
+        columns.append(block_columns)
+        values.append(block_values)
+
+    if not rows:
+        # No rows to multiply, e.g. an empty good_fields.json
+        return sparse.csr_matrix((left.shape[0], right.shape[1]), dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(left.shape[0], right.shape[1]),
+    )
+
+def field_cooccurrence(incidence, k):
+    """Field x field counts of detections using both fields, top k per field."""
+    incidence_t = incidence.T.tocsr()
+    return pruned_product(incidence_t, incidence, k)
+
+def detection_similarity(incidence, k, metric="cosine", min_similarity=0.0):
+    """Detection x detection similarity of their field sets (cosine or Jaccard), top k per detection."""
+    field_counts = np.asarray(incidence.sum(axis=1)).ravel()
+
+    if metric == "cosine":
+        norms = np.sqrt(field_counts)
+        norms[norms == 0] = 1
+        normalized = sparse.diags(1 / norms) @ incidence
+        return pruned_product(normalized.tocsr(), normalized.T.tocsr(), k, min_value=min_similarity)
+
+    def to_jaccard(block, first_row):
+        # |A and B| / (|A| + |B| - |A and B|), applied only to the nonzero intersections
+        block = block.tocoo()
+        union = field_counts[block.row + first_row] + field_counts[block.col] - block.data
+        return sparse.csr_matrix((block.data / union, (block.row, block.col)), shape=block.shape)
+
+    return pruned_product(incidence, incidence.T.tocsr(), k, transform=to_jaccard, min_value=min_similarity)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sparse field co-occurrence and detection similarity matrices from good_fields.json.")
+    parser.add_argument("--fields", default=GOOD_FIELDS_JSON, help=f"parsed field records (default {GOOD_FIELDS_JSON})")
+    parser.add_argument("--metric", choices=["cosine", "jaccard"], default="cosine", help="detection similarity metric (default cosine)")
+    parser.add_argument("--top-k", type=int, default=20, help="entries kept per row of each matrix (default 20)")
+    parser.add_argument("--min-similarity", type=float, default=0.0, help="drop detection similarities below this")
+    args = parser.parse_args()
+
+    with open(args.fields, "r", encoding="utf-8") as f:
+        field_records = json.load(f)
+
+    incidence, detections, fields = build_incidence_matrix(field_records)
+    print(f"{len(detections)} detections x {len(fields)} fields, {incidence.nnz} entries")
+
+    cooccurrence = field_cooccurrence(incidence, args.top_k)
+    similarity = detection_similarity(incidence, args.top_k, args.metric, args.min_similarity)
+
+    try:
+        sparse.save_npz(INCIDENCE_NPZ, incidence)
+        sparse.save_npz(COOCCURRENCE_NPZ, cooccurrence)
+        sparse.save_npz(SIMILARITY_NPZ, similarity)
+        with open(INDEX_JSON, "w", encoding="utf-8") as f:
+            json.dump({
+                "detections": detections,
+                "fields": fields,
+                "field_detection_counts": np.asarray(incidence.sum(axis=0)).ravel().astype(int).tolist(),
+                "similarity_metric": args.metric,
+                "top_k": args.top_k,
+            }, f)
+        print(f"Wrote {INCIDENCE_NPZ}, {COOCCURRENCE_NPZ}, {SIMILARITY_NPZ} and {INDEX_JSON}")
+    except Exception as e:
+        print(f"Failed to write co-occurrence files: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@ import os
 import re
 import yaml
 import json
+import csv
+import argparse
+import hashlib
+import multiprocessing
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +16,19 @@ SENTINEL_RULES = os.getenv("SENTINEL_RULES")
 JSON_OUTPUT_GOOD_FIELDS = os.path.join("good_fields.json")
 JSON_OUTPUT_BAD_FIELDS = os.path.join("bad_fields.json")
 DETECTION_PROFILES = os.path.join("detection_profiles.json")
+# Extracted fields without their classification, for reclassify_detections.py
+FIELD_TABLE = "field_table.json"
+# Partial result written by --shard i/N, combined by merge_detection_shards.py
+SHARD_OUTPUT = "detection_profiles_shard_{index}_of_{count}.json"
+# Checkpoint journal of per-file results, read back by --resume
+JOURNAL = "detection_profiles.journal"
+SHARD_JOURNAL = "detection_profiles_shard_{index}_of_{count}.journal"
+JOURNAL_FSYNC_INTERVAL = 100
+# Per-file budgets; files over budget are skipped and listed in QUARANTINE_CSV. 0 turns a budget off.
+MAX_FILE_BYTES = 5 * 1024 * 1024
+MAX_QUERY_LENGTH = 200000
+PARSE_TIMEOUT = 30
+QUARANTINE_CSV = "quarantine.csv"
 
 # classifcations must be in lower
 CLASSIFICATION_MAPPING = {
@@ -40,6 +57,25 @@ CLASSIFICATION_MAPPING = {
 
 CLASSIFICATIONS = {"user", "process", "host", "network"}
 
+# Sentinel entity types from a rule's entityMappings, mapped onto the same classifications.
+# Entity types not listed here count as unknown.
+ENTITY_CLASSIFICATION_MAPPING = {
+    "account": "user",
+    "mailbox": "user",
+    "securitygroup": "user",
+    "host": "host",
+    "iotdevice": "host",
+    "ip": "network",
+    "dns": "network",
+    "url": "network",
+    "file": "process",
+    "filehash": "process",
+    "process": "process",
+    "registrykey": "process",
+    "registryvalue": "process",
+    "malware": "process",
+}
+
 def parse_kql_for_fields(query_text, detection_filename):
     good_fields_data = []
     bad_fields_data = []
@@ -169,21 +205,73 @@ def good_field_names(field_name):
         return field_name
     return None
 
-def map_field_to_classification(good_field):
+def map_field_to_classification(good_field, mapping=None):
     field_lower = good_field.lower()
-    for key, field_classification in CLASSIFICATION_MAPPING.items():
+    for key, field_classification in (mapping if mapping is not None else CLASSIFICATION_MAPPING).items():
         if key in field_lower:
             if field_classification in CLASSIFICATIONS:
                 return field_classification
     return "unknown"
 
-# Just incase we need to map more then one classification to a field to weight fields
-"""
-def map_field_to_classification(good_field):
+def map_field_to_classifications(good_field, mapping=None):
+    """
+    Multi-label version of map_field_to_classification: every classification with a key found in the
+    field gets an equal share of the field's weight (hostaccountname -> host 0.5, user 0.5).
+    Returns {classification: weight}, {"unknown": 1.0} when no key matches.
+    """
     field_lower = good_field.lower()
-    classification = [field_classification for key, field_classification in CLASSIFICATION_MAPPING.items() if key in field_lower]
-    return classifications if classification else ["unknown"]
-"""
+    classifications = []
+    for key, field_classification in (mapping if mapping is not None else CLASSIFICATION_MAPPING).items():
+        if key in field_lower and field_classification in CLASSIFICATIONS and field_classification not in classifications:
+            classifications.append(field_classification)
+    if not classifications:
+        return {"unknown": 1.0}
+    return {classification: 1 / len(classifications) for classification in classifications}
+
+def entity_mapping_fields(data, detection_filename):
+    """
+    Build field records from the rule's entityMappings and customDetails sections instead of the KQL.
+    Each mapped column counts once toward the classification of its entity type; customDetails columns
+    are classified by name the same way parsed fields are. Returns an empty list if the rule declares neither.
+    """
+    mapped_fields_data = []
+
+    entity_mappings = data.get("entityMappings")
+    # Malformed entries (not a mapping, or a field mapping without a column) are skipped; if nothing
+    # usable is left the rule falls back to the KQL parse
+    for entity in entity_mappings if isinstance(entity_mappings, list) else []:
+        if not isinstance(entity, dict):
+            continue
+        entity_type = str(entity.get("entityType", "")).lower()
+        field_classification = ENTITY_CLASSIFICATION_MAPPING.get(entity_type, "unknown")
+        field_mappings = entity.get("fieldMappings")
+        for field_mapping in field_mappings if isinstance(field_mappings, list) else []:
+            if not isinstance(field_mapping, dict) or not field_mapping.get("columnName"):
+                continue
+            mapped_fields_data.append({
+                "type": "ENTITY",
+                "line": f"{entity.get('entityType', '')}.{field_mapping.get('identifier', '')}",
+                "detection": detection_filename,
+                "field": str(field_mapping["columnName"]).lower(),
+                "entity": entity_type,
+                "classification": field_classification
+            })
+
+    custom_details = data.get("customDetails")
+    for detail_name, column in custom_details.items() if isinstance(custom_details, dict) else []:
+        if not isinstance(column, str) or not column:
+            continue
+        field = column.lower()
+        good_field = good_field_names(field)
+        mapped_fields_data.append({
+            "type": "CUSTOM",
+            "line": f"{detail_name}: {column}",
+            "detection": detection_filename,
+            "field": field,
+            "classification": map_field_to_classification(good_field) if good_field else "unknown"
+        })
+
+    return mapped_fields_data
 
 def create_detection_profile(detection_filename, good_fields_data):
     classification_counts = {
@@ -207,6 +295,10 @@ def create_detection_profile(detection_filename, good_fields_data):
         elif classification == "unknown":
             classification_counts["Unknown"] += 1
 
+    return build_detection_profile(detection_filename, classification_counts)
+
+def build_detection_profile(detection_filename, classification_counts):
+    """Profile from per-class counts (or weighted scores), with Overall the largest of User/Host/Network/Process."""
     # If all specific counts (User, Host, Network, Process) are zero, overall is Unknown.
     if (classification_counts["User"] == 0 and
         classification_counts["Host"] == 0 and
@@ -237,45 +329,243 @@ def create_detection_profile(detection_filename, good_fields_data):
 
     return detection_profile
 
-def main():
-    all_good_fields = []
-    all_bad_fields = []
-    detection_profiles = []
-
-    if not os.path.exists(SENTINEL_RULES):
-        print(f"'{SENTINEL_RULES}' not found")
-        exit()
-
-    for root, dirs, files in os.walk(SENTINEL_RULES):
-        for file in files:
+def load_rule_yaml(yaml_path):
+    """Load a rule YAML, using libyaml's loader when PyYAML was built with it."""
+    with open(yaml_path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+def iter_rule_files(rules_dir):
+    """
+    Yield (relative path, full path) for every rule YAML under rules_dir.
+    Directories and files are walked in sorted order so every run (and every shard) sees the same sequence.
+    """
+    for root, dirs, files in os.walk(rules_dir):
+        dirs.sort()
+        for file in sorted(files):
             if file.endswith(".yaml"):
                 yaml_path = os.path.join(root, file)
-                print(f"Processing file: {yaml_path}")
-                try:
-                    with open(yaml_path, "r", encoding="utf-8") as f:
-                        data = yaml.safe_load(f)
-                except Exception as e:
-                    print(f"Error reading/parsing file {file}: {e}")
-                    continue
+                yield os.path.relpath(yaml_path, rules_dir).replace(os.sep, "/"), yaml_path
+
+def iter_rules(rules_dir):
+    """Yield (detection, data) for every rule YAML with a query."""
+    for relative_path, yaml_path in iter_rule_files(rules_dir):
+        file = os.path.basename(yaml_path)
+        try:
+            data = load_rule_yaml(yaml_path)
+        except Exception as e:
+            print(f"Error reading/parsing file {file}: {e}")
+            continue
+        # Skip files that aren't a rule mapping or whose query isn't text (e.g. "query:" left empty)
+        if not isinstance(data, dict) or not isinstance(data.get("query"), str) or not data["query"].strip():
+            continue
+        yield file, data
+
+def shard_for_path(relative_path, shard_count):
+    """Stable shard assignment from a hash of the rule's path relative to SENTINEL_RULES."""
+    digest = hashlib.sha1(relative_path.encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count
+
+def empty_result(status="ok", reason=None):
+    result = {"status": status, "profile": None, "profile_fields": [], "good_fields": [], "bad_fields": []}
+    if reason:
+        result["reason"] = reason
+    return result
+
+def process_rule_file(yaml_path, entity_mappings=False, with_fields=False, max_query_length=0):
+    """
+    Load one rule YAML and build its detection profile and field records.
+    Returns a dict with a status ("ok", "error", "no_query", "no_name" or "quarantined"); the profile and
+    field lists are only filled in when the status is "ok".
+    """
+    file = os.path.basename(yaml_path)
+
+    print(f"Processing file: {yaml_path}")
+    try:
+        data = load_rule_yaml(yaml_path)
+    except Exception as e:
+        print(f"Error reading/parsing file {file}: {e}")
+        return empty_result("error")
+
+    return process_rule(data, file, entity_mappings, with_fields, max_query_length)
+
+def process_rule(data, file, entity_mappings=False, with_fields=False, max_query_length=0):
+    """Build the detection profile and field records of a loaded rule; see process_rule_file."""
+    result = empty_result()
 
-                query_text = data.get("query", "")
-                if not query_text.strip():
-                    print(f"No query found in file: {file}")
-                    continue
+    if not isinstance(data, dict):
+        print(f"File format incorrect. Not a rule in file: {file}")
+        return empty_result("error", "top level of the file is not a mapping")
 
-                rule_name = data.get("name", "")
-                if not rule_name.strip():
-                    print(f"File format incorrect. No name in file: {file}")
-                    continue
+    query_text = data.get("query")
+    if not isinstance(query_text, str) or not query_text.strip():
+        print(f"No query found in file: {file}")
+        result["status"] = "no_query"
+        return result
 
-                good_fields_data, bad_fields_data = parse_kql_for_fields(query_text, file)
+    rule_name = data.get("name")
+    if not isinstance(rule_name, str) or not rule_name.strip():
+        print(f"File format incorrect. No name in file: {file}")
+        result["status"] = "no_name"
+        return result
 
-                # Create the detection profile
-                detection_profile = create_detection_profile(file, good_fields_data)
-                detection_profiles.append(detection_profile)
+    if max_query_length and len(query_text) > max_query_length:
+        print(f"Query in {file} is {len(query_text)} characters, over the {max_query_length} limit")
+        return empty_result("quarantined", f"query is {len(query_text)} characters (limit {max_query_length})")
 
-                all_good_fields.extend(good_fields_data)
-                all_bad_fields.extend(bad_fields_data)
+    mapped_fields_data = entity_mapping_fields(data, file) if entity_mappings else []
+
+    # Only pay for the KQL parse when there is nothing mapped or the field output is wanted
+    if mapped_fields_data and not with_fields:
+        good_fields_data, bad_fields_data = [], []
+    else:
+        good_fields_data, bad_fields_data = parse_kql_for_fields(query_text, file)
+
+    # Create the detection profile
+    profile_fields_data = mapped_fields_data or good_fields_data
+    result["profile"] = create_detection_profile(file, profile_fields_data)
+    result["profile_fields"] = [unclassified_field(field) for field in profile_fields_data]
+    result["good_fields"] = good_fields_data
+    result["bad_fields"] = bad_fields_data
+    return result
+
+def unclassified_field(field_data):
+    """
+    The part of a field record the classification is computed from, for the field table.
+    Entity-mapped fields keep their entity type, everything else is classified by field name.
+    """
+    field = {"type": field_data["type"], "field": field_data["field"]}
+    if "entity" in field_data:
+        field["entity"] = field_data["entity"]
+    return field
+
+def run_guarded(function, args):
+    """function(*args), with an exception turned into an "error" result so one malformed rule can't end the run."""
+    try:
+        return function(*args)
+    except Exception as e:
+        print(f"Error processing rule: {e}")
+        return empty_result("error", str(e))
+
+def _parse_worker_loop(connection):
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        function, args = request
+        connection.send(run_guarded(function, args))
+
+class ParseWorker:
+    """
+    Runs process_rule_file (or process_rule) in a child process so a rule that takes too long (a huge inlined IOC list,
+    a regex that backtracks) can be abandoned: the worker is killed and a fresh one started.
+    """
+
+    def __init__(self):
+        self._start()
+
+    def _start(self):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_parse_worker_loop, args=(child_connection,), daemon=True)
+        self.process.start()
+
+    def _restart(self):
+        self.process.kill()
+        self.process.join()
+        self._start()
+
+    def run(self, timeout, function, *args):
+        """
+        The result of function(*args), or None if it didn't finish within timeout seconds.
+        If the worker process dies (e.g. out of memory) the rule comes back quarantined with that reason.
+        """
+        self.connection.send((function, args))
+        if self.connection.poll(timeout):
+            try:
+                return self.connection.recv()
+            except EOFError:
+                self._restart()
+                return empty_result("quarantined", "worker process exited while processing the file")
+        self._restart()
+        return None
+
+    def close(self):
+        if self.process.is_alive():
+            self.connection.send(None)
+        self.process.join()
+
+def iter_rule_sources(rules_dir, arm_bundles=()):
+    """
+    Yield (relative path, source) for every rule to process: ("yaml", full path) for each rule file under
+    rules_dir, then ("arm", rule) for each alert rule streamed out of the exported ARM template bundles.
+    A bundled rule's relative path is "<bundle file name>#<index>", which keeps it stable for sharding.
+    A bundle that can't be read to the end keeps the rules read so far and adds ("bundle_error", reason)
+    under the bundle's path, so it shows up in the quarantine report.
+    """
+    if rules_dir:
+        for relative_path, yaml_path in iter_rule_files(rules_dir):
+            yield relative_path, ("yaml", yaml_path)
+
+    if arm_bundles:
+        # ijson is only needed when reading bundles
+        from arm_rule_bundles import BUNDLE_ERRORS, iter_arm_alert_rules
+        for bundle_path in arm_bundles:
+            print(f"Streaming rules from bundle: {bundle_path}")
+            index = 0
+            try:
+                for name, rule in iter_arm_alert_rules(bundle_path):
+                    yield f"{os.path.basename(bundle_path)}#{index}", ("arm", rule)
+                    index += 1
+            except BUNDLE_ERRORS as e:
+                reason = f"bundle could not be read after {index} rules: {' '.join(str(e).split())}"
+                print(f"Error reading bundle {bundle_path}: {reason}")
+                yield bundle_path, ("bundle_error", reason)
+
+def source_sha256(source):
+    kind, value = source
+    if kind == "yaml":
+        return file_sha256(value)
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+def process_source_with_budget(source, worker, options):
+    """Process one rule source under the per-file budgets in options; rules over budget come back quarantined."""
+    kind, value = source
+    if kind == "bundle_error":
+        return empty_result("quarantined", value)
+    args = (options["entity_mappings"], options["with_fields"], options["max_query_length"])
+    if kind == "yaml":
+        size = os.path.getsize(value)
+        if options["max_bytes"] and size > options["max_bytes"]:
+            print(f"Skipping {value}: {size} bytes, over the {options['max_bytes']} limit")
+            return empty_result("quarantined", f"file is {size} bytes (limit {options['max_bytes']})")
+        function, function_args, label = process_rule_file, (value,) + args, value
+    else:
+        print(f"Processing bundled rule: {value['name']}")
+        function, function_args, label = process_rule, (value, value["name"]) + args, value["name"]
+
+    if worker is None:
+        return run_guarded(function, function_args)
+
+    result = worker.run(options["parse_timeout"], function, *function_args)
+    if result is None:
+        print(f"Gave up on {label} after {options['parse_timeout']} seconds")
+        return empty_result("quarantined", f"parse took longer than {options['parse_timeout']} seconds")
+    return result
+
+def write_outputs(results, weighted=False):
+    """
+    Write DETECTION_PROFILES.JSON, good_fields.json, bad_fields.json and the unclassified field table
+    (used by reclassify_detections.py) from per-file results, in order. With weighted, the profiles are
+    rebuilt from the field table with weighted multi-label scores. Returns the detection profiles.
+    """
+    detection_profiles = [result["profile"] for result in results if result["status"] == "ok"]
+    all_good_fields = [field for result in results for field in result["good_fields"]]
+    all_bad_fields = [field for result in results for field in result["bad_fields"]]
+    field_table = [{"detection": result["profile"]["detection"], "fields": result["profile_fields"]}
+                   for result in results if result["status"] == "ok"]
+
+    if weighted:
+        from weighted_classification import weighted_detection_profiles
+        detection_profiles = weighted_detection_profiles(field_table)
 
     print("Trying to build detection profile")
     try:
@@ -300,8 +590,215 @@ def main():
         print(f"Bad fields written to {JSON_OUTPUT_BAD_FIELDS}")
     except Exception as e:
         print(f"Failed to write {JSON_OUTPUT_BAD_FIELDS}: {e}")
-    
-    
+
+    print("Writing field table")
+    try:
+        with open(FIELD_TABLE, "w", encoding="utf-8") as jsonfile:
+            json.dump(field_table, jsonfile)
+        print(f"Field table written to {FIELD_TABLE}")
+    except Exception as e:
+        print(f"Failed to write {FIELD_TABLE}: {e}")
+
+    quarantined = [result for result in results if result["status"] == "quarantined"]
+    if quarantined:
+        print(f"{len(quarantined)} files quarantined")
+    try:
+        with open(QUARANTINE_CSV, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "reason"])
+            for result in quarantined:
+                writer.writerow([result["path"], result["reason"]])
+        print(f"Quarantine report written to {QUARANTINE_CSV}")
+    except Exception as e:
+        print(f"Failed to write {QUARANTINE_CSV}: {e}")
+
+    return detection_profiles
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def mapping_sha256():
+    """
+    Hash of the classification mappings. Journaled results hold classified fields, so a journal written
+    with different mappings can't be reused. Key order is kept since the first matching key wins.
+    """
+    mappings = json.dumps([CLASSIFICATION_MAPPING, ENTITY_CLASSIFICATION_MAPPING])
+    return hashlib.sha256(mappings.encode("utf-8")).hexdigest()
+
+def load_journal(journal_path, options):
+    """
+    Read a checkpoint journal into {relative path: entry}, later entries winning.
+    A line cut short by a crash is skipped, and a journal written with different options is ignored.
+    """
+    entries = {}
+    if not os.path.exists(journal_path):
+        return entries
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if line_number == 0:
+                if entry.get("options") != options:
+                    print(f"{journal_path} was written with different options, not resuming from it")
+                    return {}
+                continue
+            entries[entry["path"]] = entry
+    return entries
+
+class CheckpointJournal:
+    """
+    Append-only journal with one JSON line per processed file (its path, hash and result), after a header
+    line with the run's options. Flushed and fsynced every JOURNAL_FSYNC_INTERVAL files so a killed run
+    loses at most that many files of work.
+    """
+
+    def __init__(self, journal_path, options, resume=False):
+        self.journal_path = journal_path
+        self.options = options
+        self.pending = 0
+        if resume and os.path.exists(journal_path):
+            self.file = open(journal_path, "a", encoding="utf-8")
+            # A crash can leave half a line behind; start the next entry on a fresh line
+            self.file.write("\n")
+        else:
+            self.file = open(journal_path, "w", encoding="utf-8")
+            self.file.write(json.dumps({"options": options}) + "\n")
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry) + "\n")
+        self.pending += 1
+        if self.pending >= JOURNAL_FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def compact(self, entries):
+        """Replace the journal with exactly one entry per file of the finished run."""
+        self.sync()
+        self.file.close()
+        compact_path = self.journal_path + ".tmp"
+        with open(compact_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"options": self.options}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(compact_path, self.journal_path)
+
+def parse_shard(value):
+    """Parse a --shard value of the form i/N (0 <= i < N)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got '{value}'")
+    return index, count
+
+def main():
+    parser = argparse.ArgumentParser(description="Build detection profiles from Sentinel rule YAML files.")
+    parser.add_argument("--entity-mappings", action="store_true",
+                        help="classify rules from entityMappings/customDetails; the KQL is only parsed for rules without them")
+    parser.add_argument("--with-fields", action="store_true",
+                        help="with --entity-mappings, still parse every query so the field JSON files are complete")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="only process the files hashed to shard i of N and write a partial result for merge_detection_shards.py")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the results in the checkpoint journal for files that haven't changed since they were journaled")
+    parser.add_argument("--arm-bundle", action="append", default=[], metavar="PATH",
+                        help="also read the alert rules in an exported ARM template / JSON rule bundle (can be repeated, needs ijson)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_FILE_BYTES,
+                        help=f"quarantine rule files larger than this (default {MAX_FILE_BYTES}, 0 for no limit)")
+    parser.add_argument("--max-query-length", type=int, default=MAX_QUERY_LENGTH,
+                        help=f"quarantine rules whose query is longer than this (default {MAX_QUERY_LENGTH}, 0 for no limit)")
+    parser.add_argument("--parse-timeout", type=float, default=PARSE_TIMEOUT,
+                        help=f"quarantine files that take longer than this many seconds to process (default {PARSE_TIMEOUT}, 0 to process in-process without a limit)")
+    parser.add_argument("--weighted", action="store_true",
+                        help="score each field toward every classification it matches, split evenly (needs numpy and scipy)")
+    args = parser.parse_args()
+
+    rules_dir = SENTINEL_RULES
+    if not rules_dir or not os.path.exists(rules_dir):
+        print(f"'{SENTINEL_RULES}' not found")
+        if not args.arm_bundle:
+            exit()
+        rules_dir = None
+
+    options = {
+        "entity_mappings": args.entity_mappings,
+        "with_fields": args.with_fields,
+        "max_bytes": args.max_bytes,
+        "max_query_length": args.max_query_length,
+        "parse_timeout": args.parse_timeout,
+        "mapping_sha256": mapping_sha256(),
+    }
+    if args.shard:
+        journal_path = SHARD_JOURNAL.format(index=args.shard[0], count=args.shard[1])
+    else:
+        journal_path = JOURNAL
+    journaled = load_journal(journal_path, options) if args.resume else {}
+    if journaled:
+        print(f"Resuming: {len(journaled)} files already in {journal_path}")
+    journal = CheckpointJournal(journal_path, options, resume=bool(journaled))
+    worker = ParseWorker() if args.parse_timeout else None
+
+    results = []
+    journal_entries = []
+    total_files = 0
+    for ordinal, (relative_path, source) in enumerate(iter_rule_sources(rules_dir, args.arm_bundle)):
+        total_files += 1
+        if args.shard and shard_for_path(relative_path, args.shard[1]) != args.shard[0]:
+            continue
+
+        digest = source_sha256(source)
+        entry = journaled.get(relative_path)
+        if entry is None or entry["sha256"] != digest:
+            entry = {"path": relative_path, "sha256": digest,
+                     "result": process_source_with_budget(source, worker, options)}
+            journal.append(entry)
+        journal_entries.append(entry)
+
+        result = dict(entry["result"], path=relative_path, ordinal=ordinal)
+        results.append(result)
+
+    if worker:
+        worker.close()
+    journal.compact(journal_entries)
+
+    if args.shard:
+        shard_index, shard_count = args.shard
+        shard_output = SHARD_OUTPUT.format(index=shard_index, count=shard_count)
+        partial = {
+            "manifest": {
+                "shard": shard_index,
+                "shards": shard_count,
+                "total_files": total_files,
+                # Weighting only changes how the merged profiles are scored, so it isn't part of the journal options
+                "options": dict(options, weighted=args.weighted),
+                "files": [result["path"] for result in results],
+            },
+            "results": results,
+        }
+        print(f"Writing shard {shard_index}/{shard_count}")
+        try:
+            with open(shard_output, "w", encoding="utf-8") as jsonfile:
+                json.dump(partial, jsonfile)
+            print(f"Shard result written to {shard_output}")
+        except Exception as e:
+            print(f"Failed to write {shard_output}: {e}")
+    else:
+        write_outputs(results, args.weighted)
+
     print("Done")
 
 if __name__ == "__main__":
@@ -0,0 +1,255 @@
+import re
+
+# Helpers for splitting a KQL query into its statements and pipe stages.
+# This isn't a full KQL parser: it tracks quotes and brackets well enough that a '|' or ';'
+# inside a string literal, a function call or a join subquery doesn't split the query.
+
+OPENING_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+CLOSING_BRACKETS = {")", "]", "}"}
+
+OPERATOR_PATTERN = re.compile(r'^([a-z][a-z0-9_-]*)', re.IGNORECASE)
+LET_PATTERN = re.compile(r'^let\s+([a-z_][a-z0-9_]*)\s*=', re.IGNORECASE)
+STRING_PATTERN = re.compile(r'@"[^"]*"|@\'[^\']*\'|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+
+def strip_comments(query_text):
+    """Remove // comments that are not inside a string literal."""
+    output = []
+    quote = None
+    verbatim = False
+    i = 0
+    while i < len(query_text):
+        char = query_text[i]
+        if quote:
+            output.append(char)
+            if char == "\\" and not verbatim and i + 1 < len(query_text):
+                output.append(query_text[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            verbatim = query_text[i - 1:i] == "@"
+            output.append(char)
+        elif query_text.startswith("//", i):
+            newline = query_text.find("\n", i)
+            if newline == -1:
+                break
+            i = newline
+            continue
+        else:
+            output.append(char)
+        i += 1
+    return "".join(output)
+
+def strip_strings(query_text):
+    """Replace every string literal with an empty one so keyword searches only see query code."""
+    return STRING_PATTERN.sub("''", query_text)
+
+def split_top_level(text, separator):
+    """
+    Split text on separator where it is not inside quotes or brackets.
+    Returns None if the quotes or brackets are unbalanced.
+    """
+    parts = []
+    current = []
+    stack = []
+    quote = None
+    verbatim = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            current.append(char)
+            if char == "\\" and not verbatim and i + 1 < len(text):
+                current.append(text[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            verbatim = text[i - 1:i] == "@"
+            current.append(char)
+        elif char in OPENING_BRACKETS:
+            stack.append(OPENING_BRACKETS[char])
+            current.append(char)
+        elif char in CLOSING_BRACKETS:
+            if not stack or stack.pop() != char:
+                return None
+            current.append(char)
+        elif char == separator and not stack:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+
+    if quote or stack:
+        return None
+    parts.append("".join(current))
+    return parts
+
+def split_statements(query_text):
+    """Split a query into its ';'-separated statements, comments removed. Returns None if unbalanced."""
+    statements = split_top_level(strip_comments(query_text), ";")
+    if statements is None:
+        return None
+    return [statement.strip() for statement in statements if statement.strip()]
+
+def split_stages(statement, normalize_whitespace=True):
+    """
+    Split one statement into its pipe stages; the first stage is the source expression.
+    Runs of whitespace are collapsed to one space unless normalize_whitespace is False (then stages are only stripped).
+    """
+    stages = split_top_level(statement, "|")
+    if stages is None:
+        return None
+    if not normalize_whitespace:
+        return [stage.strip() for stage in stages]
+    return [" ".join(stage.split()) for stage in stages]
+
+def stage_operator(stage):
+    """The lowercased operator a stage starts with, e.g. 'where', 'summarize', 'mv-expand'."""
+    match = OPERATOR_PATTERN.match(stage)
+    return match.group(1).lower() if match else ""
+
+def parse_query(query_text, normalize_whitespace=True):
+    """
+    Split a query into a list of statements, each a dict with:
+      - "let": the name bound by a let statement (None for the tabular expression)
+      - "stages": the statement's pipe stages (for a let, the part after '=')
+    Returns None if the query's quotes or brackets don't balance.
+    """
+    statements = split_statements(query_text)
+    if statements is None:
+        return None
+
+    parsed = []
+    for statement in statements:
+        let_name = None
+        body = statement
+        match = LET_PATTERN.match(statement)
+        if match:
+            let_name = match.group(1)
+            body = statement[match.end():].strip()
+        stages = split_stages(body, normalize_whitespace)
+        if stages is None:
+            return None
+        parsed.append({"let": let_name, "stages": stages})
+    return parsed
+
+def find_closing_bracket(text, start):
+    """Index of the bracket closing the one at text[start], or -1 if it isn't closed."""
+    depth = 0
+    quote = None
+    verbatim = False
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\" and not verbatim:
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            verbatim = text[i - 1:i] == "@"
+        elif char in OPENING_BRACKETS:
+            depth += 1
+        elif char in CLOSING_BRACKETS:
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+# Stage sources that are operators or literals rather than a table name
+NON_TABLE_WORDS = {
+    "union", "search", "find", "datatable", "print", "range", "externaldata", "evaluate", "materialize",
+    "toscalar", "view", "true", "false", "dynamic", "datetime", "timespan", "now", "ago",
+}
+
+IDENTIFIER_PATTERN = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*\*?|\*)\s*(\(?)')
+OPERATOR_OPTION_PATTERN = re.compile(r'^(?:(?:kind|withsource|isfuzzy|hint\.[a-z_]+)\s*=\s*[A-Za-z0-9_]+\s*)+', re.IGNORECASE)
+
+def _source_tables(expression, let_names, tables):
+    """Add the table(s) a tabular expression starts from: a table name, union members or a nested subquery."""
+    expression = expression.strip()
+    if expression.startswith("("):
+        end = find_closing_bracket(expression, 0)
+        if end == -1:
+            return
+        body = expression[end + 1:].strip()
+        if body.startswith("{"):
+            # A let-bound function, (params) { body }: only the body reads tables
+            body_end = find_closing_bracket(body, 0)
+            if body_end != -1:
+                _expression_tables(body[1:body_end], let_names, tables)
+        else:
+            _expression_tables(expression[1:end], let_names, tables)
+        return
+
+    operator = stage_operator(expression)
+    if operator == "union":
+        members = expression[len("union"):].strip()
+        members = OPERATOR_OPTION_PATTERN.sub("", members)
+        for member in split_top_level(members, ",") or []:
+            _source_tables(member, let_names, tables)
+        return
+
+    match = IDENTIFIER_PATTERN.match(expression)
+    if not match:
+        return
+    name, call = match.group(1), match.group(2)
+    if call and name.lower() in ("materialize", "toscalar"):
+        # The argument is a tabular expression of its own
+        end = find_closing_bracket(expression, match.end() - 1)
+        if end != -1:
+            _expression_tables(expression[match.end():end], let_names, tables)
+        return
+    # Other function calls (and a union member's wildcard) and let-bound names aren't tables
+    if call or name.lower() in NON_TABLE_WORDS or name in let_names:
+        return
+    if name not in tables:
+        tables.append(name)
+
+def join_right_side(stage):
+    """The right-hand expression of a join or lookup stage."""
+    rest = stage.split(None, 1)[1] if " " in stage else ""
+    rest = OPERATOR_OPTION_PATTERN.sub("", rest.strip())
+    if rest.startswith("("):
+        end = find_closing_bracket(rest, 0)
+        return rest[:end + 1] if end != -1 else ""
+    return rest.split(" on ", 1)[0]
+
+def _expression_tables(expression, let_names, tables):
+    stages = split_stages(expression)
+    if not stages:
+        return
+    _source_tables(stages[0], let_names, tables)
+    for stage in stages[1:]:
+        operator = stage_operator(stage)
+        if operator in ("join", "lookup"):
+            _source_tables(join_right_side(stage), let_names, tables)
+        elif operator == "union":
+            # A piped union adds its members to the rows coming down the pipe
+            _source_tables(stage, let_names, tables)
+
+def extract_tables(query_text):
+    """
+    The source tables a query reads, in order of first appearance: the leading table of each
+    tabular statement (including let-bound subqueries and materialize()/toscalar() arguments), union
+    members (leading or piped) and join/lookup right sides.
+    Names bound by let statements are not counted as tables. Returns [] if the query doesn't parse.
+    """
+    statements = parse_query(query_text)
+    if statements is None:
+        return []
+    return statement_tables(statements)
+
+def statement_tables(statements):
+    """extract_tables for a query already split by parse_query."""
+    let_names = {statement["let"] for statement in statements if statement["let"]}
+    tables = []
+    for statement in statements:
+        _expression_tables(" | ".join(statement["stages"]), let_names, tables)
+    return tables
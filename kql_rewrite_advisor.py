@@ -0,0 +1,419 @@
+import os
+import re
+import csv
+import json
+from collections import Counter
+from dotenv import load_dotenv
+
+from generate_detection_profiles import MAX_QUERY_LENGTH, iter_rules
+from kql_pipeline import STRING_PATTERN, join_right_side, parse_query, stage_operator, statement_tables
+
+load_dotenv()
+
+SENTINEL_RULES = os.getenv("SENTINEL_RULES")
+FINDINGS_CSV = "kql_rewrite_findings.csv"
+REWRITES_JSON = "kql_rewrites.json"
+
+# Stage text in the findings report is cut to this many characters
+STAGE_PREVIEW = 160
+
+FILTER_OPERATORS = {"where", "filter"}
+# Operators that drop columns; a join with one of these only after it carried every column through
+PRUNING_OPERATORS = {"project", "project-away", "project-keep", "summarize", "distinct"}
+# Operators that shrink a join input to a summary, so that side is probably the smaller one
+REDUCING_OPERATORS = {"summarize", "distinct", "take", "limit", "top", "count"}
+# Operators a hoisted parse_json column survives unchanged, and operators that drop it (so it can be used in them last)
+KEEPS_COLUMNS_OPERATORS = {"where", "filter", "extend", "order", "sort", "top", "take", "limit"}
+CONSUMES_COLUMNS_OPERATORS = {"project", "summarize"}
+# Operators whose unnamed expressions get a column name derived from the expression text
+NAMES_COLUMNS_OPERATORS = {"extend", "project", "summarize"}
+
+# Word operators and literals in a predicate that aren't column names
+PREDICATE_WORDS = {
+    "and", "or", "not", "in", "between", "has", "has_cs", "hasprefix", "hasprefix_cs", "hassuffix", "hassuffix_cs",
+    "has_any", "has_all", "contains", "contains_cs", "notcontains", "notcontains_cs", "startswith", "startswith_cs",
+    "endswith", "endswith_cs", "matches", "regex", "true", "false", "null",
+}
+
+IDENTIFIER_PATTERN = re.compile(r'(?<![\w.$])([A-Za-z_][A-Za-z0-9_]*)(?!\w)(?!\s*\()')
+BRACKETED_COLUMN_PATTERN = re.compile(r'\[\s*@?["\']')
+ASSIGNMENT_PATTERN = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(?!=)')
+BY_PATTERN = re.compile(r'\bby\b')
+# Window and row functions depend on which rows reach the extend, so a filter can't move above them
+ROW_FUNCTION_PATTERN = re.compile(r'\b(?:row_number|row_cumsum|row_rank\w*|row_window_session|prev|next)\s*\(')
+CONTAINS_PATTERN = re.compile(r'(!?)\bcontains(_cs)?(\s+)(@?)(["\'])([A-Za-z0-9]{3,})\5')
+PARSE_JSON_PATTERN = re.compile(r'\b(?:parse_json|parsejson|todynamic)\s*\(\s*([A-Za-z_][A-Za-z0-9_]*)\s*\)')
+TIME_FILTER_PATTERN = re.compile(
+    r'\bago\s*\(|\bbetween\b|\bTimeGenerated\b|\bTimestamp\b|\bdatetime\s*\(|\bstartof(?:day|week|month|year)\s*\(|\bnow\s*\(',
+    re.IGNORECASE,
+)
+
+def _blank_string(match):
+    literal = match.group(0)
+    prefix = 2 if literal.startswith("@") else 1
+    return literal[:prefix] + " " * (len(literal) - prefix - 1) + literal[-1]
+
+def mask_strings(text):
+    """Blank out the inside of every string literal (keeping the quotes) so positions still line up with text."""
+    return STRING_PATTERN.sub(_blank_string, text)
+
+def sub_outside_strings(pattern, replacement, text):
+    """pattern.sub(replacement, text), leaving matches that start inside a string literal alone."""
+    spans = [string.span() for string in STRING_PATTERN.finditer(text)]
+
+    def replace(match):
+        if any(start <= match.start() < end for start, end in spans):
+            return match.group(0)
+        return replacement(match)
+
+    return pattern.sub(replace, text)
+
+def predicate_columns(predicate):
+    """
+    The column names a where predicate reads, or None if it uses a ['bracketed'] column name
+    that can't be checked.
+    """
+    masked = mask_strings(predicate)
+    if BRACKETED_COLUMN_PATTERN.search(masked):
+        return None
+    return {name for name in IDENTIFIER_PATTERN.findall(masked) if name.lower() not in PREDICATE_WORDS}
+
+def top_level_split(text, pattern):
+    """Split text at the first match of pattern that's outside strings and brackets."""
+    masked = mask_strings(text)
+    for match in pattern.finditer(masked):
+        prefix = masked[:match.start()]
+        if sum(prefix.count(c) for c in "([{") == sum(prefix.count(c) for c in ")]}"):
+            return text[:match.start()], text[match.end():]
+    return text, None
+
+def top_level_items(items_text):
+    """The comma-separated items of an operator's argument list, with strings masked."""
+    masked = mask_strings(items_text)
+    items = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(masked + ","):
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(masked[start:i])
+            start = i + 1
+    return items
+
+def assigned_columns(items_text):
+    """Column names assigned by a comma-separated 'name = expression' list, or None if any item isn't named."""
+    names = []
+    for item in top_level_items(items_text):
+        match = ASSIGNMENT_PATTERN.match(item)
+        if not match:
+            return None
+        names.append(match.group(1))
+    return names
+
+def operator_body(stage):
+    """A stage without its leading operator."""
+    operator = stage_operator(stage)
+    return stage[len(operator):].strip()
+
+def preview(stage):
+    text = " ".join(stage.split())
+    return text if len(text) <= STAGE_PREVIEW else text[:STAGE_PREVIEW - 3] + "..."
+
+def finding(check, statement_index, stage, detail):
+    return {"check": check, "statement": statement_index + 1, "stage": preview(stage), "detail": detail}
+
+def skipped(reason):
+    return {"check": "skipped", "statement": "", "stage": "", "detail": reason, "rewrite": ""}
+
+def contains_findings(statements):
+    """
+    'contains "term"' where 'has "term"' could do, for literals that are a single alphanumeric term of 3+
+    characters. has looks the term up in the term index instead of scanning every value, but only matches
+    whole terms ('contains "admin"' matches "administrator", 'has "admin"' doesn't), so these are left for
+    review rather than rewritten.
+    """
+    findings = []
+    for statement_index, statement in enumerate(statements):
+        for stage in statement["stages"]:
+            spans = [string.span() for string in STRING_PATTERN.finditer(stage)]
+            for match in CONTAINS_PATTERN.finditer(stage):
+                if any(start <= match.start() < end for start, end in spans):
+                    continue
+                negation, case_sensitive, _, _, quote, literal = match.groups()
+                original = f"{negation}contains{case_sensitive or ''} {quote}{literal}{quote}"
+                findings.append(finding("contains-to-has", statement_index, stage,
+                                        f"{original} -> {original.replace('contains', 'has', 1)} if the value is always a whole term"))
+    return findings
+
+def can_push_past(where_stage, stage):
+    """Whether a where stage directly after stage can run before it with the same result."""
+    predicate = operator_body(where_stage)
+    columns = predicate_columns(predicate)
+    if not columns:
+        return False
+
+    operator = stage_operator(stage)
+    if operator == "extend":
+        body = operator_body(stage)
+        if ROW_FUNCTION_PATTERN.search(mask_strings(body)):
+            return False
+        extended = assigned_columns(body)
+        return extended is not None and not columns & set(extended)
+
+    if operator == "summarize":
+        _, keys = top_level_split(operator_body(stage), BY_PATTERN)
+        if keys is None:
+            return False
+        key_names = [key.strip() for key in keys.split(",")]
+        # Only plain group-by columns keep their values; bin(...) or renamed keys don't
+        if not all(re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', key) for key in key_names):
+            return False
+        return columns <= set(key_names)
+
+    return False
+
+def push_down_filters(statements):
+    """
+    Move where stages above an extend that doesn't define the columns they read, and above a summarize
+    when they only read its plain group-by columns, so fewer rows reach the extend or aggregation.
+    """
+    findings = []
+    for statement_index, statement in enumerate(statements):
+        stages = statement["stages"]
+        moved = True
+        while moved:
+            moved = False
+            # Stage 0 is the source; nothing moves above it
+            for i in range(1, len(stages) - 1):
+                if stage_operator(stages[i + 1]) in FILTER_OPERATORS and can_push_past(stages[i + 1], stages[i]):
+                    findings.append(finding("push-down-filter", statement_index, stages[i + 1],
+                                            f"filter can run before '{stage_operator(stages[i])}'"))
+                    stages[i], stages[i + 1] = stages[i + 1], stages[i]
+                    moved = True
+    return findings, []
+
+def parse_json_window(stages, first, column):
+    """
+    Indexes of the stages, from the first use on, where a column parsed before stages[first] can stand in
+    for parse_json(column): up to the first stage that drops columns (included) or reassigns the column
+    (excluded). Empty if stages[first] reassigns the column itself.
+    """
+    assignment = re.compile(rf'(?<![\w.$]){re.escape(column)}\s*=(?!=)')
+    if assignment.search(mask_strings(stages[first])):
+        return []
+
+    window = [first]
+    for i in range(first + 1, len(stages)):
+        operator = stage_operator(stages[i])
+        if assignment.search(mask_strings(stages[i])) or operator not in KEEPS_COLUMNS_OPERATORS | CONSUMES_COLUMNS_OPERATORS:
+            break
+        window.append(i)
+        if operator in CONSUMES_COLUMNS_OPERATORS:
+            break
+    return window
+
+def uses_only_in_named_items(stage, column_pattern):
+    """
+    False if the stage uses the call in an unnamed extend/project/summarize item: that column's name is
+    derived from the expression, so replacing the call would rename it.
+    """
+    if stage_operator(stage) not in NAMES_COLUMNS_OPERATORS:
+        return True
+    aggregates, keys = top_level_split(operator_body(stage), BY_PATTERN)
+    items = top_level_items(aggregates) + (top_level_items(keys) if keys is not None else [])
+    return all(ASSIGNMENT_PATTERN.match(item) for item in items if column_pattern.search(item))
+
+def hoist_parse_json(statements):
+    """
+    When the same column is parsed with parse_json/todynamic more than once, parse it once in an extend
+    before the first use and read the parsed column after that. Unless the last stage using it drops it
+    (project/summarize), the parsed column is removed again with project-away so the output columns don't change.
+    """
+    findings = []
+    added = []
+    existing_text = format_query(statements)
+    for statement_index, statement in enumerate(statements):
+        stages = statement["stages"]
+        checked = set()
+        stage_index = 1
+        while stage_index < len(stages):
+            columns = [match.group(1) for match in PARSE_JSON_PATTERN.finditer(mask_strings(stages[stage_index]))]
+            for column in dict.fromkeys(columns):
+                if column in checked:
+                    continue
+                checked.add(column)
+
+                column_pattern = re.compile(rf'\b(?:parse_json|parsejson|todynamic)\s*\(\s*{re.escape(column)}\s*\)')
+                window = parse_json_window(stages, stage_index, column)
+                count = sum(len(column_pattern.findall(mask_strings(stages[i]))) for i in window)
+                parsed_name = f"{column}_parsed"
+                if count < 2 or re.search(rf'\b{parsed_name}\b', existing_text):
+                    continue
+                if not all(uses_only_in_named_items(stages[i], column_pattern) for i in window):
+                    continue
+
+                for i in window:
+                    stages[i] = sub_outside_strings(column_pattern, lambda match: parsed_name, stages[i])
+                if stage_operator(stages[window[-1]]) not in CONSUMES_COLUMNS_OPERATORS:
+                    stages.insert(window[-1] + 1, f"project-away {parsed_name}")
+                    added.append("project-away")
+                stages.insert(stage_index, f"extend {parsed_name} = parse_json({column})")
+                stage_index += 1
+                added.append("extend")
+                findings.append(finding("repeated-parse-json", statement_index, stages[stage_index],
+                                        f"{column} is parsed {count} times; parse it once into {parsed_name}"))
+            stage_index += 1
+    return findings, added
+
+def join_findings(statements):
+    """
+    Report (without rewriting) joins whose inputs aren't pruned until after the join, joins with an input
+    that has no time filter of its own, and joins whose right side is reduced while the left isn't.
+    """
+    findings = []
+    let_text = {statement["let"]: " | ".join(statement["stages"]) for statement in statements if statement["let"]}
+    for statement_index, statement in enumerate(statements):
+        stages = statement["stages"]
+        for j in range(1, len(stages)):
+            if stage_operator(stages[j]) != "join":
+                continue
+            left_stages = stages[:j]
+            left_text = " | ".join(left_stages)
+            if left_stages[0].strip() in let_text:
+                left_text = let_text[left_stages[0].strip()] + " | " + left_text
+            right_text = join_right_side(" ".join(stages[j].split()))
+            # A right side that names a let statement reads whatever that statement does
+            right_name = right_text.strip().strip("()").strip()
+            right_text = let_text.get(right_name, right_text)
+            right_operators = {stage_operator(part.strip()) for part in right_text.strip().strip("()").split("|")}
+            left_operators = {stage_operator(stage) for stage in left_stages[1:]}
+
+            if any(stage_operator(stage) in PRUNING_OPERATORS for stage in stages[j + 1:]):
+                unpruned = []
+                if not left_operators & PRUNING_OPERATORS:
+                    unpruned.append("left")
+                if not right_operators & PRUNING_OPERATORS:
+                    unpruned.append("right")
+                if unpruned:
+                    findings.append(finding("project-after-join", statement_index, stages[j],
+                                            f"columns are only pruned after the join; project the needed columns on the {' and '.join(unpruned)} side before it"))
+
+            unbounded = []
+            if not TIME_FILTER_PATTERN.search(mask_strings(left_text)):
+                unbounded.append("left")
+            if not TIME_FILTER_PATTERN.search(mask_strings(right_text)):
+                unbounded.append("right")
+            if unbounded:
+                findings.append(finding("join-time-bound", statement_index, stages[j],
+                                        f"no time filter on the {' or '.join(unbounded)} side of the join; only the rule's queryPeriod bounds it"))
+
+            if right_operators & REDUCING_OPERATORS and not left_operators & REDUCING_OPERATORS:
+                findings.append(finding("join-side-order", statement_index, stages[j],
+                                        "the right side is summarized but the left isn't; put the smaller table on the left of the join"))
+    return findings
+
+def format_query(statements):
+    """Rebuild a query from parsed statements, one pipe stage per line. Comments aren't kept."""
+    formatted = []
+    for statement in statements:
+        body = "\n| ".join(statement["stages"])
+        formatted.append(f"let {statement['let']} = {body}" if statement["let"] else body)
+    return ";\n".join(formatted)
+
+def query_operators(statements):
+    return Counter(stage_operator(stage) for statement in statements for stage in statement["stages"][1:])
+
+def query_signature(statements):
+    """What a rewrite must preserve: the let names bound, the pipe operators used and the tables read."""
+    normalized = [{"let": statement["let"], "stages": [" ".join(stage.split()) for stage in statement["stages"]]}
+                  for statement in statements]
+    return [statement["let"] for statement in normalized], query_operators(normalized), statement_tables(normalized)
+
+def validate_rewrite(original_signature, rewritten_text, added_operators=()):
+    """
+    Re-parse a rewritten query and check it against the signature of the query it came from: it must balance,
+    bind the same let names, use the same pipe operators (plus any the rewrite adds) and read the same tables.
+    """
+    rewritten = parse_query(rewritten_text)
+    if rewritten is None:
+        return False
+    let_names, operators, tables = original_signature
+    return query_signature(rewritten) == (let_names, operators + Counter(added_operators), tables)
+
+def advise_query(query_text):
+    """
+    Run every check on a query. Returns (findings, rewritten query or None). The rewrite only holds changes
+    that keep the results the same; each rewriting check is applied on top of the previous ones and kept only
+    if the result re-parses and validates, otherwise its findings are reported with the rewrite rejected.
+    """
+    if MAX_QUERY_LENGTH and len(query_text) > MAX_QUERY_LENGTH:
+        return [skipped(f"query is longer than {MAX_QUERY_LENGTH} characters; not checked")], None
+    statements = parse_query(query_text, normalize_whitespace=False)
+    if statements is None:
+        return [skipped("quotes or brackets don't balance; query not checked")], None
+
+    # Joins are judged on the query as written; a hoisted parse_json's project-away isn't real column pruning
+    findings = [dict(item, rewrite="") for item in join_findings(statements)]
+    # contains -> has can change which rows match, so it's never folded into the rewrite
+    findings.extend(dict(item, rewrite="review") for item in contains_findings(statements))
+    signature = query_signature(statements)
+    rewritten_text = None
+    for check in (push_down_filters, hoist_parse_json):
+        candidate = [{"let": statement["let"], "stages": list(statement["stages"])} for statement in statements]
+        check_findings, added_operators = check(candidate)
+        if not check_findings:
+            continue
+        candidate_text = format_query(candidate)
+        if validate_rewrite(signature, candidate_text, added_operators):
+            statements, rewritten_text = candidate, candidate_text
+            signature = query_signature(candidate)
+            status = "suggested"
+        else:
+            status = "rejected"
+        findings.extend(dict(item, rewrite=status) for item in check_findings)
+
+    return findings, rewritten_text
+
+def create_findings_csv(rows, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["detection", "check", "statement", "stage", "detail", "rewrite"])
+        for detection, item in rows:
+            writer.writerow([detection, item["check"], item["statement"], item["stage"], item["detail"], item["rewrite"]])
+
+def main():
+    if not os.path.exists(SENTINEL_RULES):
+        print(f"'{SENTINEL_RULES}' not found")
+        exit()
+
+    rows = []
+    rewrites = []
+    for file, data in iter_rules(SENTINEL_RULES):
+        query_text = data.get("query", "")
+        findings, rewritten_query = advise_query(query_text)
+        rows.extend((file, item) for item in findings)
+        if rewritten_query is not None:
+            rewrites.append({
+                "detection": file,
+                "checks": sorted({item["check"] for item in findings if item["rewrite"] == "suggested"}),
+                "original": query_text,
+                "rewritten": rewritten_query,
+            })
+
+    counts = Counter(item["check"] for _, item in rows)
+    for check, count in counts.most_common():
+        print(f"   > {check}: {count}")
+
+    try:
+        create_findings_csv(rows, FINDINGS_CSV)
+        with open(REWRITES_JSON, "w", encoding="utf-8") as f:
+            json.dump(rewrites, f, indent=2)
+        print(f"{len(rows)} findings written to {FINDINGS_CSV}, {len(rewrites)} rewritten queries to {REWRITES_JSON}")
+    except Exception as e:
+        print(f"Failed to write rewrite advice: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import sys
+import glob
+import json
+
+from generate_detection_profiles import shard_for_path, write_outputs
+from process_detection_profiles import write_csv_reports
+
+# Default partial results to merge when no files are given on the command line
+SHARD_GLOB = "detection_profiles_shard_*_of_*.json"
+
+def load_partials(shard_files):
+    partials = []
+    for shard_file in shard_files:
+        with open(shard_file, "r", encoding="utf-8") as f:
+            partials.append(json.load(f))
+    return partials
+
+def validate_partials(partials):
+    """
+    Check that the partial results make up exactly one complete run: same shard count, total file count
+    and options everywhere, every shard index present once, and every file present once in the shard
+    its path hashes to. Returns a list of problems (empty when the partials can be merged).
+    """
+    problems = []
+    if not partials:
+        return ["no shard results to merge"]
+
+    first = partials[0]["manifest"]
+    shard_count = first["shards"]
+    for partial in partials:
+        manifest = partial["manifest"]
+        for key in ("shards", "total_files", "options"):
+            if manifest[key] != first[key]:
+                problems.append(f"shard {manifest['shard']} has {key}={manifest[key]}, expected {first[key]}")
+
+    seen_shards = {}
+    for partial in partials:
+        index = partial["manifest"]["shard"]
+        seen_shards[index] = seen_shards.get(index, 0) + 1
+    for index in range(shard_count):
+        if seen_shards.get(index, 0) == 0:
+            problems.append(f"shard {index}/{shard_count} is missing")
+        elif seen_shards[index] > 1:
+            problems.append(f"shard {index}/{shard_count} appears {seen_shards[index]} times")
+
+    seen_paths = set()
+    seen_ordinals = set()
+    checked_shards = set()
+    for partial in partials:
+        index = partial["manifest"]["shard"]
+        # A repeated shard is already reported above, don't list each of its files again
+        if index in checked_shards:
+            continue
+        checked_shards.add(index)
+        for result in partial["results"]:
+            if result["path"] in seen_paths:
+                problems.append(f"{result['path']} appears in more than one shard")
+            seen_paths.add(result["path"])
+            seen_ordinals.add(result["ordinal"])
+            if shard_for_path(result["path"], shard_count) != index:
+                problems.append(f"{result['path']} does not belong to shard {index}/{shard_count}")
+
+    if len(seen_ordinals) != first["total_files"]:
+        problems.append(f"merged {len(seen_ordinals)} files, expected {first['total_files']}")
+
+    return problems
+
+def main():
+    shard_files = sys.argv[1:] or sorted(glob.glob(SHARD_GLOB))
+    print(f"Merging {len(shard_files)} shard results")
+
+    partials = load_partials(shard_files)
+    problems = validate_partials(partials)
+    if problems:
+        for problem in problems:
+            print(f"   > {problem}")
+        print("Shard results are incomplete or inconsistent, nothing written.")
+        exit(1)
+
+    # Restore the order a single-node run walks the files in
+    results = sorted((result for partial in partials for result in partial["results"]),
+                     key=lambda result: result["ordinal"])
+
+    profiles = write_outputs(results, partials[0]["manifest"]["options"].get("weighted", False))
+    write_csv_reports(profiles)
+
+    print("Done")
+
+if __name__ == "__main__":
+    main()
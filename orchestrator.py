@@ -15,11 +15,17 @@ def main():
     # 2. extract_fields_to_json.py (alternative or additional field extraction)
     # 3. generate_detection_profiles.py (creates detection profiles from fields)
     # 4. process_detection_profiles.py (produces CSV reports from profiles)
+    # 5. estimate_query_cost.py (ranks rules by static query cost, reads the YAML files directly)
+    # 6. table_usage_index.py (table -> detections index and shared-scan candidates, reads the YAML files directly)
+    # 7. kql_rewrite_advisor.py (query anti-patterns and suggested rewrites, reads the YAML files directly)
     scripts = [
         "discover_fields.py",
         "extract_fields_to_json.py",
         "generate_detection_profiles.py",
-        "process_detection_profiles.py"
+        "process_detection_profiles.py",
+        "estimate_query_cost.py",
+        "table_usage_index.py",
+        "kql_rewrite_advisor.py"
     ]
     
     for script in scripts:
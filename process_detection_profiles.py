@@ -99,23 +99,28 @@ def create_grouped_joined_classifications_csv(profiles, output_csv):
         for classification, detections in sorted_groups:
             writer.writerow([classification, len(detections), json.dumps(detections)])
 
-def main():
-    # File names (adjust as needed)
-    json_file = "DETECTION_PROFILES.json"
+def write_csv_reports(profiles):
+    """Write the three classification CSVs for the given detection profiles."""
     grouped_csv_file = "grouped_classifications.csv"
     joined_csv_file = "joined_classifications.csv"
     grouped_joined_csv_file = "grouped_joined_classifications.csv"
-    
-    profiles = load_detection_profiles(json_file)
-    
+
     create_grouped_csv(profiles, grouped_csv_file)
     create_joined_classifications_csv(profiles, joined_csv_file)
     create_grouped_joined_classifications_csv(profiles, grouped_joined_csv_file)
-    
+
     print("CSV files created:")
     print(f" - {grouped_csv_file}")
     print(f" - {joined_csv_file}")
     print(f" - {grouped_joined_csv_file}")
 
+def main():
+    # File names (adjust as needed)
+    json_file = "DETECTION_PROFILES.json"
+
+    profiles = load_detection_profiles(json_file)
+
+    write_csv_reports(profiles)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
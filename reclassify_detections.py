@@ -0,0 +1,114 @@
+import os
+import json
+import argparse
+
+from generate_detection_profiles import (
+    CLASSIFICATIONS, ENTITY_CLASSIFICATION_MAPPING, FIELD_TABLE,
+    create_detection_profile, good_field_names, map_field_to_classification,
+)
+from process_detection_profiles import get_joined_classification, write_csv_reports
+
+DETECTION_PROFILES_JSON = "DETECTION_PROFILES.JSON"
+
+def load_mapping(mapping_file):
+    """
+    Load a field -> classification mapping (same shape as CLASSIFICATION_MAPPING; keys are matched
+    as substrings in file order). Entries with a classification outside CLASSIFICATIONS are dropped.
+    """
+    with open(mapping_file, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+
+    cleaned = {}
+    for key, classification in mapping.items():
+        if classification not in CLASSIFICATIONS:
+            print(f"   > Ignoring '{key}': '{classification}' is not one of {sorted(CLASSIFICATIONS)}")
+            continue
+        cleaned[key.lower()] = classification
+    return cleaned
+
+def classify_field_table(field_table, mapping):
+    """
+    Rebuild every detection profile from the field table. Each distinct field name is classified once;
+    entity-mapped fields keep the classification of their entity type.
+    """
+    field_classifications = {}
+    for detection in field_table:
+        for field in detection["fields"]:
+            name = field["field"]
+            if "entity" not in field and name not in field_classifications:
+                good_field = good_field_names(name)
+                field_classifications[name] = map_field_to_classification(good_field, mapping) if good_field else "unknown"
+
+    profiles = []
+    for detection in field_table:
+        classified = []
+        for field in detection["fields"]:
+            if "entity" in field:
+                classification = ENTITY_CLASSIFICATION_MAPPING.get(field["entity"], "unknown")
+            else:
+                classification = field_classifications[field["field"]]
+            classified.append({"classification": classification})
+        profiles.append(create_detection_profile(detection["detection"], classified))
+    return profiles
+
+def diff_profiles(old_profiles, new_profiles):
+    """(detection, old Overall, new Overall, old joined, new joined) for every detection whose classification changed."""
+    old_by_detection = {profile["detection"]: profile for profile in old_profiles}
+    changes = []
+    for profile in new_profiles:
+        old = old_by_detection.get(profile["detection"])
+        if old is None:
+            continue
+        old_overall = old["classification"]["Overall"]
+        new_overall = profile["classification"]["Overall"]
+        old_joined = get_joined_classification(old) or ""
+        new_joined = get_joined_classification(profile) or ""
+        if old_overall != new_overall or old_joined != new_joined:
+            changes.append((profile["detection"], old_overall, new_overall, old_joined, new_joined))
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild detection profiles and CSVs from the saved field table with a new classification mapping.")
+    parser.add_argument("mapping", help="JSON file with the field -> classification mapping to apply")
+    parser.add_argument("--field-table", default=FIELD_TABLE, help=f"field table from generate_detection_profiles.py (default {FIELD_TABLE})")
+    parser.add_argument("--weighted", action="store_true",
+                        help="score each field toward every classification it matches, split evenly (needs numpy and scipy)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.field_table):
+        print(f"'{args.field_table}' not found, run generate_detection_profiles.py first")
+        exit(1)
+
+    mapping = load_mapping(args.mapping)
+    if not mapping:
+        print(f"   > '{args.mapping}' has no usable entries; every field name will be classified as unknown")
+    with open(args.field_table, "r", encoding="utf-8") as f:
+        field_table = json.load(f)
+
+    old_profiles = []
+    if os.path.exists(DETECTION_PROFILES_JSON):
+        with open(DETECTION_PROFILES_JSON, "r", encoding="utf-8") as f:
+            old_profiles = json.load(f)
+
+    if args.weighted:
+        from weighted_classification import weighted_detection_profiles
+        profiles = weighted_detection_profiles(field_table, mapping)
+    else:
+        profiles = classify_field_table(field_table, mapping)
+
+    changes = diff_profiles(old_profiles, profiles)
+    print(f"{len(changes)} detections changed classification")
+    for detection, old_overall, new_overall, old_joined, new_joined in changes:
+        print(f"   > {detection}: {old_overall} -> {new_overall} ({old_joined or '-'} -> {new_joined or '-'})")
+
+    try:
+        with open(DETECTION_PROFILES_JSON, "w", encoding="utf-8") as jsonfile:
+            json.dump(profiles, jsonfile, indent=2)
+        print(f"Detection profiles written to {DETECTION_PROFILES_JSON}")
+    except Exception as e:
+        print(f"Failed to write detection profiles: {e}")
+
+    write_csv_reports(profiles)
+
+if __name__ == "__main__":
+    main()
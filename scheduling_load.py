@@ -0,0 +1,220 @@
+import os
+import csv
+import argparse
+import numpy as np
+from datetime import timedelta
+from dotenv import load_dotenv
+
+from generate_detection_profiles import iter_rules
+from estimate_query_cost import parse_duration, estimate_query_cost
+
+load_dotenv()
+
+SENTINEL_RULES = os.getenv("SENTINEL_RULES")
+SCHEDULING_LOAD_CSV = "scheduling_load.csv"
+SCHEDULING_HOTSPOTS_CSV = "scheduling_hotspots.csv"
+SCHEDULING_OFFSETS_CSV = "scheduling_offsets.csv"
+
+# How many rules to list for each peak slot
+DRIVERS_PER_PEAK = 10
+
+def load_schedules(rules, weight_by_cost=False):
+    """
+    Collect the scheduled rules: detection names, frequency in minutes, the
+    weight of one firing (its lookback in minutes, times the static query score if weight_by_cost).
+    Rules without a usable queryFrequency/queryPeriod (e.g. NRT rules) are skipped.
+    """
+    detections, frequencies, weights, schedules = [], [], [], []
+    skipped = 0
+    for file, data in rules:
+        frequency = parse_duration(data.get("queryFrequency"))
+        period = parse_duration(data.get("queryPeriod"))
+        if not frequency or not period:
+            skipped += 1
+            continue
+
+        frequency_minutes = max(1, int(frequency / timedelta(minutes=1)))
+        period_minutes = max(1, int(period / timedelta(minutes=1)))
+        weight = period_minutes
+        if weight_by_cost:
+            weight *= estimate_query_cost(data.get("query", ""))["query score"]
+
+        detections.append(file)
+        frequencies.append(frequency_minutes)
+        weights.append(weight)
+        schedules.append((str(data.get("queryFrequency")), str(data.get("queryPeriod"))))
+
+    if skipped:
+        print(f"Skipped {skipped} rules without a queryFrequency/queryPeriod")
+
+    return detections, np.array(frequencies, dtype=np.int64), np.array(weights, dtype=np.float64), schedules
+
+def firing_buckets(frequencies, offsets, horizon_minutes, bucket_minutes):
+    """
+    Every firing of every schedule within the horizon, as (schedule index, bucket index) arrays.
+    Schedule i fires at offsets[i], offsets[i] + frequencies[i], ... up to the end of the horizon.
+    """
+    counts = np.maximum(0, -(-(horizon_minutes - offsets) // frequencies))
+    schedule_index = np.repeat(np.arange(len(frequencies)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    firing_number = np.arange(counts.sum()) - starts
+    times = offsets[schedule_index] + firing_number * frequencies[schedule_index]
+    return schedule_index, times // bucket_minutes
+
+def firing_groups(frequencies, weights, offsets):
+    """
+    Rules with the same frequency and offset fire at the same times, so they are simulated as one group.
+    Returns each group's frequency, offset, summed weight and rule count, plus the group of every rule.
+    """
+    keys, rule_group = np.unique(np.stack([frequencies, offsets], axis=1), axis=0, return_inverse=True)
+    rule_group = rule_group.ravel()
+    group_weights = np.bincount(rule_group, weights=weights, minlength=len(keys))
+    group_sizes = np.bincount(rule_group, minlength=len(keys))
+    return keys[:, 0], keys[:, 1], group_weights, group_sizes, rule_group
+
+def load_histogram(frequencies, weights, offsets, horizon_minutes, bucket_minutes):
+    """
+    Weighted load and number of firings per bucket. Also returns the group of every rule and the
+    (group, bucket) of every group firing, to find the rules behind a bucket. Memory grows with the number
+    of distinct (frequency, offset) groups times their firings, not with the number of rules.
+    """
+    bucket_count = -(-horizon_minutes // bucket_minutes)
+    group_frequencies, group_offsets, group_weights, group_sizes, rule_group = firing_groups(frequencies, weights, offsets)
+    group_index, buckets = firing_buckets(group_frequencies, group_offsets, horizon_minutes, bucket_minutes)
+    load = np.bincount(buckets, weights=group_weights[group_index], minlength=bucket_count)
+    firings = np.bincount(buckets, weights=group_sizes[group_index], minlength=bucket_count).astype(np.int64)
+    return load, firings, rule_group, group_index, buckets
+
+def suggest_offsets(frequencies, weights, bucket_minutes, horizon_minutes):
+    """
+    Stagger rules that run at the same frequency: heaviest rule first, each goes to the least loaded
+    start slot (a multiple of the bucket size below its frequency, and inside the horizon so every rule
+    still fires in the simulation). Rules that run every bucket or more often stay at offset 0.
+    """
+    offsets = np.zeros(len(frequencies), dtype=np.int64)
+    for frequency in np.unique(frequencies):
+        slot_count = int(min(frequency, horizon_minutes) // bucket_minutes)
+        if slot_count < 2:
+            continue
+        members = np.flatnonzero(frequencies == frequency)
+        members = members[np.argsort(-weights[members], kind="stable")]
+        slot_load = np.zeros(slot_count)
+        for member in members:
+            slot = int(np.argmin(slot_load))
+            slot_load[slot] += weights[member]
+            offsets[member] = slot * bucket_minutes
+    return offsets
+
+def format_minutes(minutes, horizon_minutes):
+    days, remainder = divmod(int(minutes), 24 * 60)
+    clock = f"{remainder // 60:02d}:{remainder % 60:02d}"
+    return f"{days}d {clock}" if horizon_minutes > 24 * 60 else clock
+
+def format_offset(minutes):
+    """An offset from the rule's current start time, e.g. '+00:35' or '+1d 02:00'."""
+    days, remainder = divmod(int(minutes), 24 * 60)
+    clock = f"{remainder // 60:02d}:{remainder % 60:02d}"
+    return f"+{days}d {clock}" if days else f"+{clock}"
+
+def create_load_csv(load, firings, staggered_load, bucket_minutes, horizon_minutes, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["slot", "firings", "load", "load with suggested offsets"])
+        for bucket in range(len(load)):
+            writer.writerow([
+                format_minutes(bucket * bucket_minutes, horizon_minutes),
+                int(firings[bucket]),
+                round(float(load[bucket]), 2),
+                round(float(staggered_load[bucket]), 2),
+            ])
+
+def create_hotspots_csv(peaks, load, rule_group, group_index, buckets, detections, schedules, weights, offsets,
+                        bucket_minutes, horizon_minutes, output_csv):
+    """
+    One row per rule driving each peak slot (heaviest first), with the start offset suggested for it.
+    """
+    group_count = int(rule_group.max()) + 1
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "slot", "slot load", "detection", "queryFrequency", "queryPeriod", "firings in slot",
+                         "load in slot", "suggested offset"])
+        for rank, peak in enumerate(peaks, start=1):
+            groups, group_firings = np.unique(group_index[buckets == peak], return_counts=True)
+            firings_in_slot = np.zeros(group_count, dtype=np.int64)
+            firings_in_slot[groups] = group_firings
+            rule_firings = firings_in_slot[rule_group]
+            drivers = np.flatnonzero(rule_firings)
+            driver_firings = rule_firings[drivers]
+            driver_load = weights[drivers] * driver_firings
+            order = np.argsort(-driver_load, kind="stable")[:DRIVERS_PER_PEAK]
+            for driver, firing_count, contribution in zip(drivers[order], driver_firings[order], driver_load[order]):
+                writer.writerow([
+                    rank,
+                    format_minutes(peak * bucket_minutes, horizon_minutes),
+                    round(float(load[peak]), 2),
+                    detections[driver],
+                    schedules[driver][0],
+                    schedules[driver][1],
+                    int(firing_count),
+                    round(float(contribution), 2),
+                    format_offset(offsets[driver]),
+                ])
+
+def create_offsets_csv(detections, schedules, weights, offsets, output_csv):
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["detection", "queryFrequency", "queryPeriod", "weight", "suggested offset"])
+        for index in np.argsort(-weights, kind="stable"):
+            writer.writerow([
+                detections[index],
+                schedules[index][0],
+                schedules[index][1],
+                round(float(weights[index]), 2),
+                format_offset(offsets[index]),
+            ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Histogram of scheduled rule load over time, with peak slots and staggered offsets.")
+    parser.add_argument("--horizon", default="24h", help="time span to simulate, e.g. 24h or 7d (default 24h)")
+    parser.add_argument("--bucket", default="5m", help="histogram slot size (default 5m)")
+    parser.add_argument("--weight-by-cost", action="store_true",
+                        help="multiply each firing's lookback weight by the rule's static query score")
+    parser.add_argument("--top", type=int, default=10, help="number of peak slots to report (default 10)")
+    args = parser.parse_args()
+
+    horizon = parse_duration(args.horizon)
+    bucket = parse_duration(args.bucket)
+    if not horizon or not bucket or bucket < timedelta(minutes=1):
+        print(f"Could not use --horizon '{args.horizon}' / --bucket '{args.bucket}'")
+        exit(1)
+    horizon_minutes = int(horizon / timedelta(minutes=1))
+    bucket_minutes = int(bucket / timedelta(minutes=1))
+
+    if not os.path.exists(SENTINEL_RULES):
+        print(f"'{SENTINEL_RULES}' not found")
+        exit()
+
+    detections, frequencies, weights, schedules = load_schedules(iter_rules(SENTINEL_RULES), args.weight_by_cost)
+    if not detections:
+        print("No scheduled rules found.")
+        return
+
+    no_offsets = np.zeros(len(detections), dtype=np.int64)
+    load, firings, rule_group, group_index, buckets = load_histogram(frequencies, weights, no_offsets, horizon_minutes, bucket_minutes)
+    offsets = suggest_offsets(frequencies, weights, bucket_minutes, horizon_minutes)
+    staggered_load, _, _, _, _ = load_histogram(frequencies, weights, offsets, horizon_minutes, bucket_minutes)
+
+    peaks = np.argsort(-load, kind="stable")[:args.top]
+    print(f"Peak slot load {load.max():.0f} (mean {load.mean():.0f}); with suggested offsets {staggered_load.max():.0f}")
+
+    try:
+        create_load_csv(load, firings, staggered_load, bucket_minutes, horizon_minutes, SCHEDULING_LOAD_CSV)
+        create_hotspots_csv(peaks, load, rule_group, group_index, buckets, detections, schedules, weights, offsets,
+                            bucket_minutes, horizon_minutes, SCHEDULING_HOTSPOTS_CSV)
+        create_offsets_csv(detections, schedules, weights, offsets, SCHEDULING_OFFSETS_CSV)
+        print(f"Wrote {SCHEDULING_LOAD_CSV}, {SCHEDULING_HOTSPOTS_CSV} and {SCHEDULING_OFFSETS_CSV}")
+    except Exception as e:
+        print(f"Failed to write scheduling reports: {e}")
+
+if __name__ == "__main__":
+    main()
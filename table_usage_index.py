@@ -0,0 +1,122 @@
+import os
+import csv
+import json
+from dotenv import load_dotenv
+
+from generate_detection_profiles import iter_rules
+from estimate_query_cost import parse_duration
+from kql_pipeline import extract_tables
+
+load_dotenv()
+
+SENTINEL_RULES = os.getenv("SENTINEL_RULES")
+TABLE_USAGE_CSV = "table_usage.csv"
+TABLE_CONSOLIDATION_CSV = "table_consolidation.csv"
+
+def build_table_index(rules):
+    """
+    Build table -> [rule, ...] from (detection, data) pairs in one pass over the rules.
+    Each rule entry keeps the schedule fields so the consolidation report can group on them.
+    """
+    table_index = {}
+    for detection_filename, data in rules:
+        rule = {
+            "detection": detection_filename,
+            "queryFrequency": str(data.get("queryFrequency", "") or ""),
+            "queryPeriod": str(data.get("queryPeriod", "") or ""),
+        }
+        for table in extract_tables(data.get("query", "")):
+            table_index.setdefault(table, []).append(rule)
+    return table_index
+
+def find_consolidation_clusters(table_index):
+    """
+    Group the rules reading each table by how often they run. Two or more rules that scan the same table
+    at the same frequency could share one batched or materialized query covering the longest of their periods.
+    Frequencies are compared as durations, so '60m' and '1h' land in the same cluster.
+    Wildcard union members ('*', 'Security*') are left out, they aren't one table to batch on.
+    """
+    clusters = []
+    for table, rules in table_index.items():
+        if "*" in table:
+            continue
+        by_frequency = {}
+        for rule in rules:
+            frequency = parse_duration(rule["queryFrequency"])
+            if frequency is None:
+                continue
+            by_frequency.setdefault(frequency, []).append(rule)
+
+        for frequency, cluster_rules in by_frequency.items():
+            if len(cluster_rules) < 2:
+                continue
+            periods = [parse_duration(rule["queryPeriod"]) for rule in cluster_rules]
+            longest = max((period for period in periods if period is not None), default=None)
+            clusters.append({
+                "table": table,
+                "queryFrequency": cluster_rules[0]["queryFrequency"],
+                "longest queryPeriod": next((rule["queryPeriod"] for rule, period in zip(cluster_rules, periods)
+                                             if period == longest), ""),
+                "queryPeriods": sorted({rule["queryPeriod"] for rule in cluster_rules}),
+                "detections": [rule["detection"] for rule in cluster_rules],
+            })
+
+    # Biggest clusters first: they save the most repeated scans
+    clusters.sort(key=lambda x: (-len(x["detections"]), x["table"]))
+    return clusters
+
+def create_table_usage_csv(table_index, output_csv):
+    """
+    Create a CSV with three columns:
+      - table: a source table read by at least one detection
+      - detection count: the number of detections reading it
+      - detection: a JSON array (as a string) of those detections
+    """
+    sorted_tables = sorted(table_index.items(), key=lambda x: (-len(x[1]), x[0]))
+
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["table", "detection count", "detection"])
+        for table, rules in sorted_tables:
+            writer.writerow([table, len(rules), json.dumps([rule["detection"] for rule in rules])])
+
+def create_consolidation_csv(clusters, output_csv):
+    """
+    One row per cluster of detections reading the same table at the same queryFrequency,
+    with the longest queryPeriod a shared query would need to cover.
+    """
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["table", "queryFrequency", "longest queryPeriod", "queryPeriods", "detection count", "detection"])
+        for cluster in clusters:
+            writer.writerow([
+                cluster["table"],
+                cluster["queryFrequency"],
+                cluster["longest queryPeriod"],
+                json.dumps(cluster["queryPeriods"]),
+                len(cluster["detections"]),
+                json.dumps(cluster["detections"]),
+            ])
+
+def main():
+    if not os.path.exists(SENTINEL_RULES):
+        print(f"'{SENTINEL_RULES}' not found")
+        exit()
+
+    table_index = build_table_index(iter_rules(SENTINEL_RULES))
+    clusters = find_consolidation_clusters(table_index)
+
+    try:
+        create_table_usage_csv(table_index, TABLE_USAGE_CSV)
+        print(f"{len(table_index)} tables written to {TABLE_USAGE_CSV}")
+    except Exception as e:
+        print(f"Failed to write {TABLE_USAGE_CSV}: {e}")
+
+    try:
+        create_consolidation_csv(clusters, TABLE_CONSOLIDATION_CSV)
+        print(f"{len(clusters)} consolidation candidates written to {TABLE_CONSOLIDATION_CSV}")
+    except Exception as e:
+        print(f"Failed to write {TABLE_CONSOLIDATION_CSV}: {e}")
+
+if __name__ == "__main__":
+    main()
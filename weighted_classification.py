@@ -0,0 +1,78 @@
+import numpy as np
+from scipy import sparse
+
+from generate_detection_profiles import (
+    ENTITY_CLASSIFICATION_MAPPING, build_detection_profile, good_field_names, map_field_to_classifications,
+)
+
+# Weighted multi-label profiles: a field counts toward every classification with a key found in its name,
+# split evenly, and a detection's scores are its field counts times the field -> classification weights.
+
+# Columns of the field x classification weight table, in profile order
+PROFILE_CLASSES = ["User", "Host", "Network", "Process", "Unknown"]
+CLASS_COLUMNS = {name.lower(): column for column, name in enumerate(PROFILE_CLASSES)}
+
+# Weighted scores are rounded to this many decimals in the profiles
+SCORE_DECIMALS = 3
+
+class FieldWeightTable:
+    """
+    The field x classification weight table. Each distinct field is matched against the mapping once,
+    the first time it is seen; entity-mapped fields carry the full weight of their entity type's classification.
+    """
+
+    def __init__(self, mapping=None):
+        self.mapping = mapping
+        self.rows = {}
+        self.weights = []
+
+    def row(self, field):
+        if "entity" in field:
+            key = ("entity", field["entity"])
+        else:
+            key = ("field", field["field"].lower())
+
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.weights)
+            if key[0] == "entity":
+                self.weights.append({ENTITY_CLASSIFICATION_MAPPING.get(key[1], "unknown"): 1.0})
+            else:
+                good_field = good_field_names(key[1])
+                self.weights.append(map_field_to_classifications(good_field, self.mapping) if good_field else {"unknown": 1.0})
+        return row
+
+    def matrix(self):
+        rows, columns, values = [], [], []
+        for row, weights in enumerate(self.weights):
+            for classification, weight in weights.items():
+                rows.append(row)
+                columns.append(CLASS_COLUMNS[classification])
+                values.append(weight)
+        return sparse.csr_matrix((values, (rows, columns)), shape=(len(self.weights), len(PROFILE_CLASSES)))
+
+def weighted_detection_profiles(field_table, mapping=None):
+    """
+    Detection profiles from a field table ([{"detection", "fields"}], as saved in field_table.json) with
+    weighted multi-label scores: the sparse detection x field count matrix times the field x classification
+    weight table. Overall and the joined classification follow the largest weighted scores.
+    """
+    table = FieldWeightTable(mapping)
+    rows, columns = [], []
+    for detection_row, detection in enumerate(field_table):
+        for field in detection["fields"]:
+            rows.append(detection_row)
+            columns.append(table.row(field))
+
+    # Repeated (detection, field) entries are summed, so a field used twice counts twice, as in the unweighted profiles
+    counts = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, columns)),
+        shape=(len(field_table), len(table.weights)),
+    )
+    scores = (counts @ table.matrix()).toarray().round(SCORE_DECIMALS)
+
+    profiles = []
+    for detection, detection_scores in zip(field_table, scores):
+        classification_scores = {name: float(score) for name, score in zip(PROFILE_CLASSES, detection_scores)}
+        profiles.append(build_detection_profile(detection["detection"], classification_scores))
+    return profiles